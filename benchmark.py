@@ -0,0 +1,395 @@
+import os
+import json
+import time
+import base64
+import shutil
+import socket
+import platform
+import argparse
+import collections
+import datetime
+import tempfile
+import contextlib
+import subprocess
+import numpy as np
+import psycopg2
+import psycopg2.extensions
+
+import db
+import schema
+import populate
+
+STATES = ("AZ", "NV", "OH", "NC", "PA", "WI", "IL", "SC")
+CATEGORIES = (
+    "Restaurants", "Food", "Nightlife", "Bars", "Shopping", "Coffee & Tea", "Pizza", "Mexican", "Beauty & Spas",
+    "Auto Repair", "Fitness & Instruction", "Hotels & Travel", "Italian", "Chinese", "Sandwiches", "Burgers",
+    "Breakfast & Brunch", "Home Services", "Health & Medical", "Juice Bars & Smoothies",
+)
+WORDS = ("great", "food", "service", "slow", "friendly", "staff", "price", "place", "back", "never", "again", "love")
+
+
+def yelp_ids(rng, count):
+    return [base64.urlsafe_b64encode(rng.bytes(16))[:22].decode() for _ in range(count)]
+
+
+def zipf_weights(count, skew):
+    # A few businesses and users get most of the reviews and checkins, like the real dump
+    weights = 1.0 / np.arange(1, count + 1) ** skew
+    return weights / weights.sum()
+
+
+def write_lines(path, records):
+    with open(path, 'w') as file:
+        for record in records:
+            file.write(json.dumps(record))
+            file.write('\n')
+
+
+def generate_dataset(data_dir, businesses=2000, users=5000, reviews=50000, cities=40, skew=1.1, bad_lines=0.001, seed=0):
+    # Writes yelp_business/user/review/checkin.json shaped like the fields the importers read
+    os.makedirs(data_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    business_ids = yelp_ids(rng, businesses)
+    user_ids = yelp_ids(rng, users)
+    places = [(STATES[i % len(STATES)], f"City {i}", [f"{10000 + i * 10 + z:05d}" for z in range(rng.integers(1, 6))])
+              for i in range(cities)]
+    city_weights = zipf_weights(cities, skew)
+    category_weights = zipf_weights(len(CATEGORIES), skew)
+    business_weights = zipf_weights(businesses, skew)
+    user_weights = zipf_weights(users, skew)
+
+    def business_records():
+        for business_id in business_ids:
+            state, city, zips = places[rng.choice(cities, p=city_weights)]
+            picked = rng.choice(len(CATEGORIES), size=rng.integers(1, 5), replace=False, p=category_weights)
+            yield {
+                "business_id": business_id, "name": f"Business {business_id[:6]}", "neighborhood": "",
+                "address": f"{rng.integers(1, 9999)} Main St", "city": city, "state": state,
+                "postal_code": zips[rng.integers(len(zips))],
+                "latitude": float(rng.uniform(25, 48)), "longitude": float(rng.uniform(-124, -70)),
+                "stars": float(rng.integers(2, 11) / 2), "review_count": int(rng.integers(0, 1000)),
+                "is_open": int(rng.random() < 0.8), "attributes": {"WiFi": "free"},
+                "categories": ", ".join(CATEGORIES[i] for i in picked),
+                "hours": {day: "9:00-17:00" for day in db.DAYS[:5]},
+                "registration_date": str(datetime.date(2004, 1, 1) + datetime.timedelta(days=int(rng.integers(0, 5000)))),
+                "repeat_checkins": int(rng.integers(0, 50)),
+            }
+
+    def user_records():
+        for user_id in user_ids:
+            friends = rng.choice(users, size=min(users, rng.integers(0, 30)), replace=False)
+            yield {
+                "user_id": user_id, "name": "User", "review_count": int(rng.integers(0, 500)),
+                "average_stars": float(rng.uniform(1, 5)), "useful": 0, "funny": 0, "cool": 0,
+                "friends": [user_ids[i] for i in friends], "elite": [2015, 2016] if rng.random() < 0.05 else [],
+                "fans": int(rng.integers(0, 20)), "yelping_since": f"{rng.integers(2005, 2018)}-01-01",
+            }
+
+    def review_records():
+        review_ids = yelp_ids(rng, reviews)
+        picked_businesses = rng.choice(businesses, size=reviews, p=business_weights)
+        picked_users = rng.choice(users, size=reviews, p=user_weights)
+        stars = rng.integers(1, 6, size=reviews)
+        for review_id, business, user, star in zip(review_ids, picked_businesses, picked_users, stars):
+            yield {
+                "review_id": review_id, "user_id": user_ids[user], "business_id": business_ids[business],
+                "stars": int(star), "date": f"{rng.integers(2005, 2018)}-{rng.integers(1, 13):02d}-{rng.integers(1, 29):02d}",
+                "text": " ".join(rng.choice(WORDS, size=rng.integers(5, 60))),
+                "useful": int(rng.integers(0, 5)), "funny": 0, "cool": 0,
+            }
+
+    def checkin_records():
+        busy = rng.permutation(business_weights) * businesses
+        for business_id, weight in zip(business_ids, busy):
+            slots = min(168, 1 + rng.poisson(10 * weight))
+            hours = {}
+            for slot in rng.choice(168, size=slots, replace=False):
+                hours.setdefault(db.DAYS[slot // 24], {})[f"{slot % 24}:00"] = int(1 + rng.poisson(3 * weight))
+            yield {"business_id": business_id, "time": hours}
+
+    def with_bad_lines(records):
+        # Sprinkle lines the validators must reject
+        for record in records:
+            if rng.random() < bad_lines:
+                yield {"broken": True}
+            yield record
+
+    write_lines(os.path.join(data_dir, "yelp_business.json"), with_bad_lines(business_records()))
+    write_lines(os.path.join(data_dir, "yelp_user.json"), with_bad_lines(user_records()))
+    write_lines(os.path.join(data_dir, "yelp_review.json"), with_bad_lines(review_records()))
+    write_lines(os.path.join(data_dir, "yelp_checkin.json"), with_bad_lines(checkin_records()))
+    zipcodes = sorted({zip_code for _, _, zips in places for zip_code in zips})
+    return [(zip_code, int(rng.integers(1000, 80000)), float(rng.integers(20000, 150000))) for zip_code in zipcodes]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def throwaway_postgres(pg_bin=None):
+    # A private cluster in a temp directory, reachable only over its own unix socket
+    initdb = shutil.which("initdb", path=pg_bin)
+    pg_ctl = shutil.which("pg_ctl", path=pg_bin)
+    if not initdb or not pg_ctl:
+        raise SystemExit("initdb/pg_ctl not found; put them on PATH, pass --pg-bin, or use --dsn")
+    data_dir = tempfile.mkdtemp(prefix="benchmark-pg-")
+    port = free_port()
+    try:
+        subprocess.run([initdb, "-D", data_dir, "-U", "postgres", "--auth=trust", "-E", "UTF8"],
+                       check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([pg_ctl, "-D", data_dir, "-l", os.path.join(data_dir, "server.log"), "-w",
+                        "-o", f"-p {port} -k {data_dir} -c listen_addresses=''", "start"],
+                       check=True, stdout=subprocess.DEVNULL)
+        try:
+            with throwaway_database({"host": data_dir, "port": str(port), "user": "postgres", "password": "", "dbname": "postgres"}) as config:
+                yield config
+        finally:
+            subprocess.run([pg_ctl, "-D", data_dir, "-m", "fast", "-w", "stop"], stdout=subprocess.DEVNULL)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+@contextlib.contextmanager
+def throwaway_database(server):
+    # A scratch database on an existing server, dropped afterwards
+    name = f"benchmark_{os.getpid()}"
+    admin = psycopg2.connect(**server)
+    admin.autocommit = True
+    try:
+        with admin.cursor() as cur:
+            cur.execute(f"DROP DATABASE IF EXISTS {name};")
+            cur.execute(f"CREATE DATABASE {name};")
+        try:
+            yield {**server, "dbname": name}
+        finally:
+            db.close_pool()
+            with admin.cursor() as cur:
+                cur.execute(f"DROP DATABASE IF EXISTS {name};")
+    finally:
+        admin.close()
+
+
+def use_database(config):
+    # Loader workers and the GUI pool read DB_CONFIG; spawned workers read the environment
+    db.DB_CONFIG.update(config)
+    for key, env in (("dbname", "PGDATABASE"), ("user", "PGUSER"), ("password", "PGPASSWORD"),
+                     ("host", "PGHOST"), ("port", "PGPORT")):
+        if key in config:
+            os.environ[env] = str(config[key])
+
+
+def run_imports(conn, data_dir, zipcodes, workers, batch_size, partition_reviews=False):
+    populate.ensure_import_tables(conn, partition_reviews)
+    populate.insert_data_into_db(conn, zipcodes)
+    schema.drop_secondary_indexes(conn)
+
+    started = time.perf_counter()
+    if workers > 1:
+        summary = populate.parallel_import(data_dir, conn, workers, batch_size)
+    else:
+        summary = populate.sequential_import(data_dir, conn, batch_size)
+    load_seconds = time.perf_counter() - started
+
+    timings = db.statement_timings()
+    results = {}
+    for name, stats in summary.items():
+        seconds = timings.get(f"import {name}", {}).get("total", 0.0)
+        results[name] = {
+            "rows": stats["rows"], "accepted": stats["accepted"], "rejected": stats["rejected"],
+            "failed": stats["failed"], "seconds": round(seconds, 3),
+            "rows_per_sec": round(stats["rows"] / seconds, 1) if seconds > 0 else None,
+        }
+
+    post_load = {}
+    for name, step in (("build_secondary_indexes", lambda: schema.build_secondary_indexes(conn)),
+                       ("recompute_scores", lambda: populate.recompute_scores(conn, batch_size)),
+                       ("refresh_zipcode_stats", lambda: populate.refresh_zipcode_stats(conn)),
+                       ("bump_data_version", lambda: populate.bump_data_version(conn))):
+        started = time.perf_counter()
+        step()
+        post_load[name] = round(time.perf_counter() - started, 3)
+    # Each worker reports its own peak; a sequential load runs in this process
+    worker_rss = max((stats["worker_peak_rss_kb"] for stats in summary.values()), default=0) or None
+    return {"load_seconds": round(load_seconds, 3), "tables": results, "post_load_seconds": post_load,
+            "worker_peak_rss_kb": worker_rss}
+
+
+def sample_parameters(conn, count):
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT b.state, b.city, b.postal_code, c.category, b.business_id, b.latitude, b.longitude, r.user_id
+            FROM businesses b JOIN businesscategories c ON c.business_id = b.business_id
+            LEFT JOIN LATERAL (SELECT user_id FROM reviews WHERE business_id = b.business_id LIMIT 1) AS r ON TRUE
+            ORDER BY random()
+            LIMIT %s;
+        """, (count,))
+        return cur.fetchall()
+
+
+def query_cases():
+    import businessfinder as bf
+    from spatial import SpatialIndex
+    # The first spatial call also builds the in-memory grid
+    nearby = SpatialIndex()
+    return [
+        ("get_locations", bf.get_locations, lambda s: ()),
+        ("get_states", bf.get_states, lambda s: ()),
+        ("get_cities", bf.get_cities, lambda s: (s[0],)),
+        ("get_businesses", bf.get_businesses, lambda s: (s[1], s[0])),
+        ("get_zipcodes", bf.get_zipcodes, lambda s: (s[1], s[0])),
+        ("get_categories", bf.get_categories, lambda s: (s[2],)),
+        ("get_zipcode_stats", bf.get_zipcode_stats, lambda s: (s[2],)),
+        ("get_businesses_by_category", bf.get_businesses_by_category, lambda s: (s[2], s[3])),
+        ("get_popular_businesses", bf.get_popular_businesses, lambda s: (s[2], s[3])),
+        ("get_successful_businesses", bf.get_successful_businesses, lambda s: (s[2], s[3])),
+        ("get_top_categories", bf.get_top_categories, lambda s: (s[2],)),
+        ("get_zipcode_dashboard", bf.get_zipcode_dashboard, lambda s: (s[2],)),
+        ("get_category_dashboard", bf.get_category_dashboard, lambda s: (s[2], s[3])),
+        ("get_busiest_hours", bf.get_busiest_hours, lambda s: (s[4],)),
+        ("get_total_checkins", bf.get_total_checkins, lambda s: (s[4],)),
+        ("search_reviews", bf.search_reviews, lambda s: (s[2], s[3], "friendly staff")),
+        ("search_reviews_page_3", bf.search_reviews, lambda s: (s[2], None, "slow -service", 3)),
+        ("get_friends_businesses", bf.get_friends_businesses, lambda s: (s[7],)),
+        ("get_friends_businesses_zipcode", bf.get_friends_businesses, lambda s: (s[7], s[2])),
+        ("spatial_nearest_10", nearby.search, lambda s: (s[5], s[6], 10)),
+        ("spatial_radius_25km", nearby.search, lambda s: (s[5], s[6], None, 25.0)),
+        ("spatial_near_business_open", nearby.near_business, lambda s: (s[4], 10, None, s[3], True)),
+    ]
+
+
+def run_queries(conn, runs):
+    # Every GUI query against a spread of real parameters; the first call also pays for PREPARE
+    conn.autocommit = True
+    samples = sample_parameters(conn, runs)
+    results = {}
+    if not samples:
+        return results
+    for name, query, arguments in query_cases():
+        latencies = []
+        errors = collections.Counter()
+        for i in range(runs):
+            args = arguments(samples[i % len(samples)])
+            started = time.perf_counter()
+            try:
+                query(conn, *args)
+            except psycopg2.Error as e:
+                message = str(e).strip().splitlines()[0]
+                errors[message] += 1
+                continue
+            latencies.append((time.perf_counter() - started) * 1000)
+        result = {"runs": len(latencies), "errors": sum(errors.values())}
+        if latencies:
+            p50, p95 = np.percentile(latencies, [50, 95])
+            result.update(p50_ms=round(float(p50), 3), p95_ms=round(float(p95), 3),
+                          mean_ms=round(float(np.mean(latencies)), 3), max_ms=round(float(np.max(latencies)), 3))
+        if errors:
+            result["error_messages"] = dict(errors)
+        results[name] = result
+    return results
+
+
+def server_version(conn):
+    with conn.cursor() as cur:
+        cur.execute("SHOW server_version;")
+        return cur.fetchone()[0]
+
+
+def compare(previous, current):
+    # Positive change is better for rows/sec and worse for latency
+    lines = []
+    for name, result in current["import"]["tables"].items():
+        before = previous.get("import", {}).get("tables", {}).get(name, {}).get("rows_per_sec")
+        if before and result["rows_per_sec"]:
+            lines.append(f"  import {name}: {before:,.0f} -> {result['rows_per_sec']:,.0f} rows/sec "
+                         f"({(result['rows_per_sec'] / before - 1) * 100:+.1f}%)")
+    for name, result in current["queries"].items():
+        before = previous.get("queries", {}).get(name, {}).get("p95_ms")
+        if before and result.get("p95_ms"):
+            lines.append(f"  {name}: p95 {before:.2f} -> {result['p95_ms']:.2f} ms "
+                         f"({(result['p95_ms'] / before - 1) * 100:+.1f}%)")
+    return lines
+
+
+def run_benchmark(args, server):
+    with throwaway_database(server) if server else throwaway_postgres(args.pg_bin) as config:
+        use_database(config)
+        conn = db.connect_db()
+        if conn is None:
+            raise SystemExit("could not connect to the benchmark database")
+        try:
+            data_dir = args.data_dir or tempfile.mkdtemp(prefix="benchmark-data-")
+            started = time.perf_counter()
+            zipcodes = generate_dataset(data_dir, args.businesses, args.users, args.reviews, args.cities,
+                                        args.skew, args.bad_lines, args.seed)
+            generate_seconds = time.perf_counter() - started
+            sizes = {name: os.path.getsize(os.path.join(data_dir, name)) for name in sorted(os.listdir(data_dir))}
+
+            imports = run_imports(conn, data_dir, zipcodes, args.workers, args.batch_size, args.partition_reviews)
+            rss_after_load = populate.peak_rss_kb()
+            queries = run_queries(conn, args.query_runs)
+            version = server_version(conn)
+        finally:
+            conn.close()
+            if not args.data_dir:
+                shutil.rmtree(data_dir, ignore_errors=True)
+
+    return {
+        "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "config": {key: value for key, value in vars(args).items() if key not in ("dsn", "output", "compare")},
+        "environment": {
+            "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "postgres": version,
+        },
+        "dataset": {"generate_seconds": round(generate_seconds, 3), "file_bytes": sizes},
+        "import": imports,
+        "queries": queries,
+        "peak_rss_kb": {"after_load": rss_after_load, "end": populate.peak_rss_kb()},
+        "statement_timings": db.statement_timings(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark populate.py and the businessfinder.py queries on synthetic data")
+    parser.add_argument("--dsn", help="libpq connection string of a server to create the scratch database on "
+                                      "(default: start a private cluster with initdb/pg_ctl)")
+    parser.add_argument("--pg-bin", help="directory holding initdb and pg_ctl")
+    parser.add_argument("--data-dir", help="keep the generated JSON files here instead of a temp directory")
+    parser.add_argument("--businesses", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--reviews", type=int, default=50000)
+    parser.add_argument("--cities", type=int, default=40)
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent for reviews/checkins per business")
+    parser.add_argument("--bad-lines", type=float, default=0.001, help="fraction of malformed lines to inject")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--partition-reviews", action="store_true", help="range-partition Reviews by year")
+    parser.add_argument("--query-runs", type=int, default=200, help="calls per GUI query")
+    parser.add_argument("--output", help="result file (default benchmark-<timestamp>.json, ignored by git)")
+    parser.add_argument("--compare", help="earlier result file to print the change against")
+    args = parser.parse_args()
+
+    server = dict(psycopg2.extensions.parse_dsn(args.dsn)) if args.dsn else None
+    results = run_benchmark(args, server)
+    output = args.output or f"benchmark-{datetime.datetime.now():%Y%m%d-%H%M%S}.json"
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    for name, result in results["import"]["tables"].items():
+        print(f"{name}: {result['rows']} rows, {result['rows_per_sec'] or 0:,.0f} rows/sec, {result['rejected']} rejected")
+    for name, result in results["queries"].items():
+        if result["runs"]:
+            print(f"{name}: p50 {result['p50_ms']:.2f} ms, p95 {result['p95_ms']:.2f} ms")
+        else:
+            print(f"{name}: failed ({result['errors']} errors)")
+    worker_rss = results["import"]["worker_peak_rss_kb"]
+    print(f"Peak RSS: {results['peak_rss_kb']['end']:,} KB"
+          + (f" (largest loader worker {worker_rss:,} KB)" if worker_rss else ""))
+    if args.compare:
+        with open(args.compare) as file:
+            print(f"Compared with {args.compare}:")
+            print("\n".join(compare(json.load(file), results)))
+    print(f"Results written to {output}")
@@ -1,79 +1,693 @@
-import psycopg2
 import json
+import time
+import threading
+import collections
+import functools
+import os
+import sys
+import snapshot
+from db import (
+    DB_CONFIG, DAYS, execute, get_data_version, pooled_connection, POOL_MAX, HISTOGRAM_BUCKETS_MS, SLOW_QUERY_MS,
+    record_timing, statement_timings, slow_queries, reset_timings, dump_timings
+)
 
-def connect_db():
-    try:
-        conn = psycopg2.connect(
-            dbname="milestone1db",
-            user="postgres",
-            password="admin",
-            host="localhost"
-        )
-        return conn
-    except Exception as e:
-        print(f"error: {e}")
+PAGE_SIZE = 200
+CACHE_SIZE = 512
+CACHE_TTL = 300
+VERSION_CHECK_INTERVAL = 10
+# Written on exit when set, e.g. BUSINESSFINDER_TIMINGS=timings.json
+TIMINGS_FILE = os.environ.get("BUSINESSFINDER_TIMINGS")
+# Browse a local file written by snapshot.py instead of the server, e.g. BUSINESSFINDER_SNAPSHOT=businessfinder.sqlite
+SNAPSHOT_FILE = os.environ.get("BUSINESSFINDER_SNAPSHOT")
+# The state -> city -> zipcode tree from the last run, shown at startup while the server is asked whether it changed;
+# kept in the user's cache directory (~/.cache/milestone1/locations.json by default), not the checkout
+LOCATIONS_CACHE = os.environ.get("BUSINESSFINDER_LOCATIONS_CACHE", os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "milestone1", "locations.json"
+))
+LOCATIONS_SOURCE = "{host}:{port}/{dbname}".format(**DB_CONFIG)
 
 def get_states(conn):
     with conn.cursor() as cur:
-        cur.execute("SELECT DISTINCT state FROM business ORDER BY state;")
+        execute(cur, "get_states", "SELECT DISTINCT state FROM businesses ORDER BY state;")
         states = cur.fetchall()
         return states
 
 def get_cities(conn, selected_state):
     with conn.cursor() as cur:
-        cur.execute("SELECT DISTINCT city FROM business WHERE state=%s ORDER BY city;", (selected_state,))
+        execute(cur, "get_cities", "SELECT DISTINCT city FROM businesses WHERE state=%s ORDER BY city;", (selected_state,))
         cities = cur.fetchall()
         return cities
 
-def get_businesses(conn, selected_city, selected_state):
+def get_locations(conn):
+    # The whole state -> city -> zipcode hierarchy in one statement: (state, city, [zipcodes]) rows
     with conn.cursor() as cur:
-        cur.execute("SELECT name, city, state FROM business WHERE city=%s AND state=%s ORDER BY name;", (selected_city, selected_state))
-        businesses = cur.fetchall()
-        return businesses
+        execute(cur, "get_locations", """
+            SELECT state, city, array_agg(DISTINCT postal_code ORDER BY postal_code)
+            FROM businesses
+            WHERE state IS NOT NULL AND city IS NOT NULL
+            GROUP BY state, city
+            ORDER BY state, city;
+        """)
+        return cur.fetchall()
+
+class LocationTree:
+    # state -> city -> zipcodes, in display order, for the location widgets
+    def __init__(self, tree, generation=None):
+        self.tree = tree
+        self.generation = generation
+
+    @classmethod
+    def from_rows(cls, rows, generation=None):
+        tree = {}
+        for state, city, zipcodes in rows:
+            tree.setdefault(state, {})[city] = [zipcode for zipcode in zipcodes if zipcode is not None]
+        return cls(tree, generation)
+
+    def states(self):
+        return list(self.tree)
+
+    def cities(self, state):
+        return list(self.tree.get(state, {}))
+
+    def zipcodes(self, state, city):
+        return self.tree.get(state, {}).get(city, [])
+
+    @classmethod
+    def load(cls, path, source):
+        # None when there is no usable cache for this database
+        try:
+            with open(path) as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(entry, dict) or entry.get("source") != source or not isinstance(entry.get("tree"), dict):
+            return None
+        return cls(entry["tree"], entry.get("generation"))
+
+    def save(self, path, source):
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path + ".tmp", 'w') as file:
+                json.dump({"source": source, "generation": self.generation, "tree": self.tree}, file)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"Could not write {path}: {e}")
+
+def refresh_locations(conn, cached=None, data_version=get_data_version, locations=get_locations, cache_path=None, source=None):
+    # A new LocationTree, or None when cached was made from the current data version
+    generation = data_version(conn)
+    if cached is not None and generation is not None and generation == cached.generation:
+        return None
+    tree = LocationTree.from_rows(locations(conn), generation)
+    if cache_path and generation is not None:
+        tree.save(cache_path, source)
+    return tree
+
+# The business table is read a page at a time: ordered by (name, business_id), each page after
+# the first starts past the last row already shown, so a page costs the same wherever it is.
+# business_id comes last and is not shown; "Near selected business" reads it.
+BUSINESSES_SQL = """
+    SELECT name, city, state, stars, review_count, reviewrating, numCheckins,
+    is_open, hours, business_id
+    FROM businesses b
+    WHERE city=%s AND state=%s {after}
+    ORDER BY b.name, b.business_id
+    LIMIT %s;
+"""
+
+BUSINESSES_BY_CATEGORY_SQL = """
+    SELECT name, city, state, stars, review_count, reviewrating, numCheckins,
+    is_open, hours, business_id
+    FROM businesses b
+    WHERE postal_code = %s AND EXISTS (
+        SELECT 1 FROM businesscategories c WHERE c.business_id = b.business_id AND c.category = %s
+    ) {after}
+    ORDER BY b.name, b.business_id
+    LIMIT %s;
+"""
+
+AFTER_SQL = "AND (b.name, b.business_id) > (%s, %s)"
+
+def business_page(conn, name, sql, params, after, limit):
+    # after is the (name, business_id) of the last row shown; limit None is every row
+    with conn.cursor() as cur:
+        if after is None:
+            execute(cur, name, sql.format(after=""), params + (limit,))
+        else:
+            execute(cur, f"{name}_after", sql.format(after=AFTER_SQL), params + tuple(after) + (limit,))
+        return cur.fetchall()
+
+def get_businesses(conn, selected_city, selected_state, after=None, limit=None):
+    return business_page(conn, "get_businesses", BUSINESSES_SQL, (selected_city, selected_state), after, limit)
 
 def get_zipcodes(conn, selected_city, selected_state):
     with conn.cursor() as cur:
-        cur.execute("SELECT DISTINCT postal_code FROM businesses WHERE city=%s AND state=%s ORDER BY postal_code;", (selected_city, selected_state))
+        execute(cur, "get_zipcodes", "SELECT DISTINCT postal_code FROM businesses WHERE city=%s AND state=%s ORDER BY postal_code;", (selected_city, selected_state))
         zipcodes = cur.fetchall()
         return zipcodes
 
 def get_categories(conn, selected_zipcode):
     with conn.cursor() as cur:
-        cur.execute("""
-            SELECT DISTINCT UNNEST(string_to_array(categories, ', ')) AS category
-            FROM businesses
-            WHERE postal_code=%s
-            ORDER BY category;
+        execute(cur, "get_categories", """
+            SELECT DISTINCT c.category
+            FROM businesses b
+            JOIN businesscategories c ON c.business_id = b.business_id
+            WHERE b.postal_code=%s
+            ORDER BY c.category;
         """, (selected_zipcode,))
         categories = cur.fetchall()
         return categories
 
-def get_businesses_by_category(conn, selected_zipcode, selected_category):
+def get_zipcode_stats(conn, selected_zipcode):
     with conn.cursor() as cur:
-        cur.execute("""
-            SELECT name, city, state, stars, review_count, reviewrating, "numCheckins",
-            is_open, hours
-            FROM businesses
-            WHERE postal_code = %s AND categories LIKE %s
-            ORDER BY name;
-        """, (selected_zipcode, '%' + selected_category + '%',))
+        execute(cur, "get_zipcode_stats", """
+            SELECT business_count, population, avg_income, open_business_count, mean_stars, total_checkins
+            FROM zipcodestats
+            WHERE zip_code = %s;
+        """, (selected_zipcode,))
+        stats = cur.fetchone()
+        return stats
+
+def get_businesses_by_category(conn, selected_zipcode, selected_category, after=None, limit=None):
+    return business_page(
+        conn, "get_businesses_by_category", BUSINESSES_BY_CATEGORY_SQL, (selected_zipcode, selected_category), after, limit
+    )
+
+def get_popular_businesses(conn, selected_zipcode, selected_category):
+    with conn.cursor() as cur:
+        execute(cur, "get_popular_businesses", """
+            SELECT name, stars, review_count
+            FROM businesses b
+            WHERE postal_code = %s AND EXISTS (
+                SELECT 1 FROM businesscategories c WHERE c.business_id = b.business_id AND c.category = %s
+            )
+            ORDER BY review_count DESC
+            LIMIT 5;
+        """, (selected_zipcode, selected_category))
+        businesses = cur.fetchall()
+        return businesses
+
+def get_successful_businesses(conn, selected_zipcode, selected_category):
+    with conn.cursor() as cur:
+        execute(cur, "get_successful_businesses", """
+            SELECT review_count, numCheckins
+            FROM businesses b
+            WHERE postal_code = %s AND EXISTS (
+                SELECT 1 FROM businesscategories c WHERE c.business_id = b.business_id AND c.category = %s
+            )
+            ORDER BY numCheckins DESC
+            LIMIT 5;
+        """, (selected_zipcode, selected_category))
         businesses = cur.fetchall()
         return businesses
 
+def get_top_categories(conn, selected_zipcode):
+    with conn.cursor() as cur:
+        execute(cur, "get_top_categories", """
+            SELECT c.category, COUNT(*)
+            FROM businesses b
+            JOIN businesscategories c ON c.business_id = b.business_id
+            WHERE b.postal_code = %s
+            GROUP BY c.category
+            ORDER BY COUNT(*) DESC;
+        """, (selected_zipcode,))
+        categories = cur.fetchall()
+        return categories
+
+def get_checkin_hours(conn, business_id):
+    # 7x24 list of checkin counts, Monday first, or None if the business has no checkins
+    with conn.cursor() as cur:
+        execute(cur, "get_checkin_hours", "SELECT hours FROM checkinhours WHERE business_id = %s;", (business_id,))
+        row = cur.fetchone()
+        return row[0] if row else None
+
+def get_busiest_hours(conn, business_id, limit=5):
+    with conn.cursor() as cur:
+        execute(cur, "get_busiest_hours", """
+            SELECT (slot - 1) / 24, (slot - 1) % 24, count
+            FROM checkinhours h, unnest(h.hours) WITH ORDINALITY AS u(count, slot)
+            WHERE h.business_id = %s AND count > 0
+            ORDER BY count DESC, slot
+            LIMIT %s;
+        """, (business_id, limit))
+        return [(DAYS[day], f"{hour}:00", count) for day, hour, count in cur.fetchall()]
+
+def get_total_checkins(conn, business_id):
+    with conn.cursor() as cur:
+        execute(cur, "get_total_checkins", "SELECT total FROM checkinhours WHERE business_id = %s;", (business_id,))
+        row = cur.fetchone()
+        return row[0] if row else 0
+
+def get_zipcode_dashboard(conn, selected_zipcode):
+    # Stats, category filter list and top categories for one zipcode in a single round trip
+    with conn.cursor() as cur:
+        execute(cur, "get_zipcode_dashboard", """
+            WITH category_counts AS (
+                SELECT c.category, COUNT(*) AS businesses
+                FROM businesses b
+                JOIN businesscategories c ON c.business_id = b.business_id
+                WHERE b.postal_code = %(zipcode)s
+                GROUP BY c.category
+            )
+            SELECT s.business_count, s.population, s.avg_income, s.open_business_count, s.mean_stars, s.total_checkins,
+                (SELECT json_agg(json_build_array(category, businesses) ORDER BY businesses DESC, category)
+                 FROM category_counts)
+            FROM (SELECT 1) AS one
+            LEFT JOIN zipcodestats s ON s.zip_code = %(zipcode)s;
+        """, {"zipcode": selected_zipcode})
+        row = cur.fetchone()
+    top_categories = [tuple(pair) for pair in row[6] or []]
+    return {
+        "stats": row[:6] if row[0] is not None else None,
+        "categories": sorted((category,) for category, _ in top_categories),
+        "top_categories": top_categories,
+    }
+
+def get_category_dashboard(conn, selected_zipcode, selected_category, limit=5):
+    # Both top-5 rankings in one round trip; the full business list is paged in by PagedTableModel.
+    # NULLS LAST in the json_agg as well as the LIMIT, or the picked rows come back in another order
+    with conn.cursor() as cur:
+        execute(cur, "get_category_dashboard", """
+            WITH matches AS (
+                SELECT name, stars, review_count, numCheckins AS checkins
+                FROM businesses b
+                WHERE postal_code = %(zipcode)s AND EXISTS (
+                    SELECT 1 FROM businesscategories c WHERE c.business_id = b.business_id AND c.category = %(category)s
+                )
+            )
+            SELECT
+                (SELECT json_agg(json_build_array(name, stars, review_count) ORDER BY review_count DESC NULLS LAST)
+                 FROM (SELECT * FROM matches ORDER BY review_count DESC NULLS LAST LIMIT %(limit)s) AS popular),
+                (SELECT json_agg(json_build_array(review_count, checkins) ORDER BY checkins DESC NULLS LAST)
+                 FROM (SELECT * FROM matches ORDER BY checkins DESC NULLS LAST LIMIT %(limit)s) AS successful);
+        """, {"zipcode": selected_zipcode, "category": selected_category, "limit": limit})
+        popular, successful = cur.fetchone()
+    return {
+        "popular": [tuple(row) for row in popular or []],
+        "successful": [tuple(row) for row in successful or []],
+    }
+
+REVIEW_PAGE_SIZE = 20
 
+def search_reviews(conn, selected_zipcode, selected_category, keywords, page=0, page_size=REVIEW_PAGE_SIZE, limit=10):
+    # One page of matching reviews plus the businesses with the best matches, ranked against the
+    # precomputed reviews.text_search column. keywords use web search syntax: "exact phrase", -word, or.
+    # Only the reviews on the page get a highlighted snippet.
+    with conn.cursor() as cur:
+        execute(cur, "search_reviews", """
+            WITH matches AS MATERIALIZED (
+                SELECT r.review_id, r.business_id, r.stars, r.date, r.text, ts_rank_cd(r.text_search, q) AS rank, q
+                FROM websearch_to_tsquery('english', %(keywords)s) AS q,
+                    reviews r JOIN businesses b ON b.business_id = r.business_id
+                WHERE r.text_search @@ q AND b.postal_code = %(zipcode)s AND (
+                    %(category)s::text IS NULL OR EXISTS (
+                        SELECT 1 FROM businesscategories c WHERE c.business_id = b.business_id AND c.category = %(category)s
+                    )
+                )
+            ),
+            page AS (
+                SELECT * FROM matches ORDER BY rank DESC, review_id LIMIT %(page_limit)s OFFSET %(offset)s
+            )
+            SELECT
+                (SELECT json_agg(json_build_array(
+                    b.name, p.stars, p.date, round(p.rank::numeric, 3),
+                    ts_headline('english', p.text, p.q, 'MaxFragments=2, MaxWords=15, MinWords=5, StartSel=[, StopSel=]')
+                 ) ORDER BY p.rank DESC, p.review_id)
+                 FROM page p JOIN businesses b ON b.business_id = p.business_id),
+                (SELECT json_agg(json_build_array(b.name, m.reviews, round(m.score::numeric, 3)) ORDER BY m.score DESC, b.name)
+                 FROM (SELECT business_id, COUNT(*) AS reviews, SUM(rank) AS score
+                       FROM matches GROUP BY business_id ORDER BY score DESC LIMIT %(limit)s) AS m
+                 JOIN businesses b ON b.business_id = m.business_id);
+        """, {
+            "keywords": keywords, "zipcode": selected_zipcode, "category": selected_category,
+            "page_limit": page_size + 1, "offset": page * page_size, "limit": limit,
+        })
+        reviews, businesses = cur.fetchone()
+    reviews = [tuple(row) for row in reviews or []]
+    return {
+        "reviews": reviews[:page_size],
+        "businesses": [tuple(row) for row in businesses or []],
+        "page": page,
+        "has_more": len(reviews) > page_size,
+    }
+
+def get_friends_businesses(conn, user_id, selected_zipcode=None, limit=20):
+    # Businesses reviewed by the user's friends, most friends first. Walks the Friends primary
+    # key from the user's key, then reviews by user_id, so only the friends' reviews are read.
+    with conn.cursor() as cur:
+        execute(cur, "get_friends_businesses", """
+            SELECT b.name, b.city, b.state, COUNT(DISTINCT r.user_id) AS friends,
+                round(AVG(r.stars), 2) AS friend_stars, MAX(r.date) AS last_review
+            FROM userids me
+            JOIN friends f ON f.user_key = me.user_key
+            JOIN userids fu ON fu.user_key = f.friend_key
+            JOIN reviews r ON r.user_id = fu.user_id
+            JOIN businesses b ON b.business_id = r.business_id
+            WHERE me.user_id = %(user_id)s AND (%(zipcode)s::text IS NULL OR b.postal_code = %(zipcode)s)
+            GROUP BY b.business_id, b.name, b.city, b.state
+            ORDER BY friends DESC, friend_stars DESC, b.name
+            LIMIT %(limit)s;
+        """, {"user_id": user_id, "zipcode": selected_zipcode, "limit": limit})
+        return cur.fetchall()
+
+
+from PyQt5.QtCore import (
+    QObject, QRunnable, QThreadPool, pyqtSignal, Qt, QAbstractTableModel, QModelIndex, QTimer
+)
+from PyQt5.QtGui import QKeySequence
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QComboBox, QVBoxLayout, QHBoxLayout,
     QWidget, QListWidget, QTableWidget, QTableWidgetItem, QLabel,
-    QPushButton, QGroupBox, QGridLayout
+    QPushButton, QGroupBox, QGridLayout, QTableView, QPlainTextEdit, QShortcut, QFileDialog, QSplitter,
+    QLineEdit, QSpinBox, QDoubleSpinBox, QCheckBox
 )
 
+class QueryCache:
+    # LRU with a TTL, keyed by query function and arguments. Entries are also dropped
+    # whenever populate.py bumps the generation in DataVersion.
+    def __init__(self, max_entries=CACHE_SIZE, ttl=CACHE_TTL, version_check_interval=VERSION_CHECK_INTERVAL,
+                 data_version=get_data_version):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version_check_interval = version_check_interval
+        self.data_version = data_version
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = None
+        self.checked_at = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def call(self, conn, query, args):
+        self.check_version(conn)
+        key = (query.__name__, args)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and time.monotonic() - entry[0] < self.ttl:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        result = query(conn, *args)
+        with self.lock:
+            self.entries[key] = (time.monotonic(), result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return result
+
+    def check_version(self, conn):
+        now = time.monotonic()
+        with self.lock:
+            if self.checked_at is not None and now - self.checked_at < self.version_check_interval:
+                return
+            self.checked_at = now
+        generation = self.data_version(conn)
+        with self.lock:
+            if generation != self.generation:
+                self.entries.clear()
+                self.generation = generation
+
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
+            self.checked_at = None
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries), "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "generation": self.generation,
+            }
+
+
+class QuerySignals(QObject):
+    finished = pyqtSignal(str, int, object)
+    failed = pyqtSignal(str, int, str)
+
+
+class QueryWorker(QRunnable):
+    def __init__(self, slot, generation, query, args, callback, cache=None, connection=pooled_connection):
+        super().__init__()
+        self.slot = slot
+        self.generation = generation
+        self.query = query
+        self.args = args
+        self.callback = callback
+        self.cache = cache
+        self.connection = connection
+        self.signals = QuerySignals()
+        self.lock = threading.Lock()
+        self.conn = None
+        self.cancelled = False
+
+    def run(self):
+        started = time.perf_counter()
+        try:
+            with self.connection() as conn:
+                with self.lock:
+                    if self.cancelled:
+                        return
+                    self.conn = conn
+                try:
+                    if self.cache is not None:
+                        result = self.cache.call(conn, self.query, self.args)
+                    else:
+                        result = self.query(conn, *self.args)
+                finally:
+                    with self.lock:
+                        self.conn = None
+        except Exception as e:
+            self.signals.failed.emit(self.slot, self.generation, str(e))
+            return
+        # Pool wait, cache lookup and every statement the query function ran
+        record_timing(f"query {self.slot}", time.perf_counter() - started)
+        self.signals.finished.emit(self.slot, self.generation, result)
+
+    def cancel(self):
+        # Skips the query if it has not started yet, otherwise asks the server to abort it
+        with self.lock:
+            self.cancelled = True
+            if self.conn is not None:
+                self.conn.cancel()
+
+
+def format_value(column, value):
+    return "" if value is None else str(value)
+
+def format_business_value(column, value):
+    if column == 7:  # is_open
+        return "Yes" if value else "No"
+    if column == 8 and isinstance(value, dict):  # hours
+        return json.dumps(value)
+    return format_value(column, value)
+
+
+def format_nearby_value(column, value):
+    if column == 4:  # is_open
+        return "Yes" if value else "No"
+    return format_value(column, value)
+
+
+class RowTableModel(QAbstractTableModel):
+    def __init__(self, headers, format_value=format_value, parent=None):
+        super().__init__(parent)
+        self.headers = headers
+        self.format_value = format_value
+        self.rows = []
+
+    def set_rows(self, rows):
+        self.beginResetModel()
+        self.rows = list(rows)
+        self.endResetModel()
+
+    def clear(self):
+        self.set_rows([])
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        row = self.rows[index.row()]
+        if index.column() >= len(row):
+            return None
+        return self.format_value(index.column(), row[index.column()])
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.headers[section]
+        return super().headerData(section, orientation, role)
+
+
+class PagedTableModel(RowTableModel):
+    # Rows come one page at a time as the view scrolls, from a query function taking
+    # (..., after, limit). Pages run on the query pool like any other query, and everything a
+    # page needs travels with it, so a page for an earlier query is recognised and dropped.
+    def __init__(self, headers, run_query, slot, format_value=format_value, page_size=PAGE_SIZE,
+                 key=lambda row: (row[0], row[-1]), parent=None):
+        super().__init__(headers, format_value, parent)
+        self.run_query = run_query
+        self.slot = slot
+        self.page_size = page_size
+        self.key = key
+        self.page_query = None
+        self.exhausted = True
+        self.fetching = False
+
+    def query(self, query, args):
+        self.clear()
+        self.page_query = (query, args)
+        self.request_page(None)
+
+    def request_page(self, after):
+        query, args = self.page_query
+        self.exhausted = False
+        self.fetching = True
+        # Only the first page goes through the query cache, so going back to a category is instant
+        self.run_query(
+            self.slot, query, args + (after, self.page_size), functools.partial(self.append_rows, self.page_query),
+            cache=after is None
+        )
+
+    def clear(self):
+        super().clear()
+        self.page_query = None
+        self.exhausted = True
+        self.fetching = False
+
+    def append_rows(self, page_query, rows):
+        if page_query is not self.page_query:
+            return
+        self.fetching = False
+        self.exhausted = len(rows) < self.page_size
+        if rows:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(rows) - 1)
+            self.rows.extend(rows)
+            self.endInsertRows()
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted and not self.fetching
+
+    def fetchMore(self, parent=QModelIndex()):
+        self.request_page(self.key(self.rows[-1]))
+
+
+class DebugPanel(QWidget):
+    # Live view of db.py's timings: per-statement and per-handler latency plus the slow-query log
+    HEADERS = ["Name", "Calls", "Mean ms", "p50 ms", "p95 ms", "Max ms", "Histogram"]
+    BARS = " \u2581\u2582\u2583\u2584\u2585\u2586\u2587\u2588"
+
+    def __init__(self, parent=None):
+        super().__init__(parent, Qt.Window)
+        self.setWindowTitle("Query timings")
+        self.resize(900, 600)
+        layout = QVBoxLayout()
+        layout.addWidget(QLabel(
+            f"query = worker time, populate = widget update, handler = request to screen. "
+            f"Slow query threshold {SLOW_QUERY_MS:.0f} ms (DB_SLOW_QUERY_MS)."
+        ))
+        self.timingsTable = QTableWidget(0, len(self.HEADERS))
+        self.timingsTable.setHorizontalHeaderLabels(self.HEADERS)
+        self.timingsTable.horizontalHeaderItem(6).setToolTip(
+            "Buckets: " + ", ".join(f"<={bound}ms" for bound in HISTOGRAM_BUCKETS_MS) + ", more"
+        )
+        self.slowQueriesText = QPlainTextEdit()
+        self.slowQueriesText.setReadOnly(True)
+        splitter = QSplitter(Qt.Vertical)
+        splitter.addWidget(self.timingsTable)
+        splitter.addWidget(self.slowQueriesText)
+        layout.addWidget(splitter)
+
+        buttonLayout = QHBoxLayout()
+        for label, handler in (("Refresh", self.refresh), ("Reset", self.reset), ("Dump to file...", self.dump)):
+            button = QPushButton(label)
+            button.clicked.connect(handler)
+            buttonLayout.addWidget(button)
+        layout.addLayout(buttonLayout)
+        self.setLayout(layout)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        self.refresh()
+        self.timer.start(2000)
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
+
+    def sparkline(self, counts):
+        peak = max(counts) or 1
+        return "".join(self.BARS[round(count / peak * (len(self.BARS) - 1))] for count in counts)
+
+    def refresh(self):
+        timings = sorted(statement_timings().items(), key=lambda item: item[1]["p95"], reverse=True)
+        self.timingsTable.setRowCount(len(timings))
+        for row, (name, timing) in enumerate(timings):
+            values = [
+                name, str(timing["calls"]), f"{timing['mean'] * 1000:.2f}", f"{timing['p50'] * 1000:.2f}",
+                f"{timing['p95'] * 1000:.2f}", f"{timing['max'] * 1000:.2f}", self.sparkline(list(timing["histogram"].values())),
+            ]
+            for column, value in enumerate(values):
+                self.timingsTable.setItem(row, column, QTableWidgetItem(value))
+        self.slowQueriesText.setPlainText("\n\n".join(
+            f"{entry['at']}  {entry['name']}  {entry['ms']:.1f} ms  params={entry['params']}\n{entry['plan']}"
+            for entry in reversed(slow_queries())
+        ))
+
+    def reset(self):
+        reset_timings()
+        self.refresh()
+
+    def dump(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Dump timings", "timings.json", "JSON (*.json)")
+        if path:
+            dump_timings(path)
+
+
 class MyApp(QMainWindow):
+    # Result slots that become stale when the selection above them changes
+    DEPENDENT_SLOTS = {
+        "cities": ("zipcode_dashboard", "stats", "category_dashboard", "businesses", "popular", "successful",
+                   "review_search"),
+        "zipcodes": ("zipcode_dashboard", "stats", "category_dashboard", "businesses", "popular", "successful",
+                     "review_search"),
+        "zipcode_dashboard": ("category_dashboard", "businesses", "popular", "successful", "review_search"),
+    }
+
     def __init__(self):
         super().__init__()
-        self.conn = connect_db() 
-        self.setWindowTitle("Milestone 1")
+        self.pool = QThreadPool.globalInstance()
+        # Never run more queries at once than the connection pool can serve
+        self.pool.setMaxThreadCount(POOL_MAX)
+        self.workers = {}
+        self.generations = {}
+        # Query functions and connections come from this module, or from snapshot.py for a local file
+        if SNAPSHOT_FILE:
+            self.queries = snapshot
+            self.connection = functools.partial(snapshot.snapshot_connection, SNAPSHOT_FILE)
+        else:
+            self.queries = sys.modules[__name__]
+            self.connection = pooled_connection
+        self.cache = QueryCache(data_version=self.queries.get_data_version)
+        self.locations = None
+        self.spatial = None
+        self.debugPanel = DebugPanel(self)
+        QShortcut(QKeySequence("F12"), self, activated=self.toggle_debug_panel)
+        self.setWindowTitle(f"Milestone 1 ({SNAPSHOT_FILE})" if SNAPSHOT_FILE else "Milestone 1")
         self.setGeometry(100, 100, 1000, 500)
         self.initUI()
+        # Runs once the window is up, so the first frame never waits on the cache file or the database
+        QTimer.singleShot(0, self.load_locations)
 
     def initUI(self):
         mainLayout = QVBoxLayout()
@@ -84,6 +698,7 @@ class MyApp(QMainWindow):
         locationLayout = QGridLayout()
         locationLayout.addWidget(QLabel("State"), 0, 0)
         self.stateComboBox = QComboBox()
+        self.stateComboBox.activated[str].connect(self.on_state_changed)
         locationLayout.addWidget(self.stateComboBox, 0, 1)
         locationLayout.addWidget(QLabel("City"), 1, 0)
         self.cityListWidget = QListWidget()
@@ -101,18 +716,19 @@ class MyApp(QMainWindow):
         statsLayout = QVBoxLayout()
         self.statsTable = QTableWidget()
         self.statsTable.setRowCount(1)
-        self.statsTable.setColumnCount(3)
-        self.statsTable.setHorizontalHeaderLabels(["# of Businesses", "Total Population", "Average Income"])
+        self.statsTable.setColumnCount(6)
+        self.statsTable.setHorizontalHeaderLabels([
+            "# of Businesses", "Total Population", "Average Income", "Open Businesses", "Mean Stars", "Total Checkins"
+        ])
         self.statsTable.horizontalHeader().setStretchLastSection(True)
         statsLayout.addWidget(self.statsTable)
         statsGroupBox.setLayout(statsLayout)
 
         categoriesGroupBox = QGroupBox("Top Categories")
         categoriesLayout = QVBoxLayout()
-        self.categoriesTable = QTableWidget()
-        self.categoriesTable.setRowCount(1)
-        self.categoriesTable.setColumnCount(2)
-        self.categoriesTable.setHorizontalHeaderLabels(["Category", "# of Businesses"])
+        self.categoriesModel = RowTableModel(["Category", "# of Businesses"])
+        self.categoriesTable = QTableView()
+        self.categoriesTable.setModel(self.categoriesModel)
         categoriesLayout.addWidget(self.categoriesTable)
         categoriesGroupBox.setLayout(categoriesLayout)
 
@@ -139,10 +755,10 @@ class MyApp(QMainWindow):
         filterLayout.addWidget(self.filterListWidget)
         filterGroupBox.setLayout(filterLayout)
 
-        self.businessTable = QTableWidget(0, 6)
-        self.businessTable.setHorizontalHeaderLabels([
-            "Name", "City", "State", "Stars", "Review Count", "Review Rating"
-        ])
+        businessHeaders = ["Name", "City", "State", "Stars", "Review Count", "Review Rating", "Checkins", "Open", "Hours"]
+        self.businessModel = PagedTableModel(businessHeaders, self.run_query, "businesses", format_business_value)
+        self.businessTable = QTableView()
+        self.businessTable.setModel(self.businessModel)
 
         secondRowLayout.addWidget(filterGroupBox)
         secondRowLayout.addWidget(self.businessTable)
@@ -177,72 +793,212 @@ class MyApp(QMainWindow):
         thirdRowLayout.addWidget(successfulGroupBox)
 
         mainLayout.addLayout(thirdRowLayout)
+
+        nearbyGroupBox = QGroupBox("Near Me")
+        nearbyLayout = QGridLayout()
+        self.latitudeEdit = QLineEdit()
+        self.latitudeEdit.setPlaceholderText("Latitude")
+        self.longitudeEdit = QLineEdit()
+        self.longitudeEdit.setPlaceholderText("Longitude")
+        self.nearbyCountSpinBox = QSpinBox()
+        self.nearbyCountSpinBox.setRange(1, 500)
+        self.nearbyCountSpinBox.setValue(10)
+        self.nearbyRadiusSpinBox = QDoubleSpinBox()
+        self.nearbyRadiusSpinBox.setRange(0, 20000)
+        self.nearbyRadiusSpinBox.setSuffix(" km")
+        self.nearbyRadiusSpinBox.setSpecialValueText("Any distance")
+        self.nearbyCategoryEdit = QLineEdit()
+        self.nearbyCategoryEdit.setPlaceholderText("Category (optional)")
+        self.nearbyOpenCheckBox = QCheckBox("Open only")
+        nearPointButton = QPushButton("Near point")
+        nearPointButton.clicked.connect(self.on_near_point)
+        nearBusinessButton = QPushButton("Near selected business")
+        nearBusinessButton.clicked.connect(self.on_near_business)
+        for column, widget in enumerate((
+            self.latitudeEdit, self.longitudeEdit, QLabel("Results"), self.nearbyCountSpinBox, QLabel("Within"),
+            self.nearbyRadiusSpinBox, self.nearbyCategoryEdit, self.nearbyOpenCheckBox, nearPointButton, nearBusinessButton,
+        )):
+            nearbyLayout.addWidget(widget, 0, column)
+        self.nearbyModel = RowTableModel(["Name", "City", "State", "Stars", "Open", "Distance (km)"], format_nearby_value)
+        self.nearbyTable = QTableView()
+        self.nearbyTable.setModel(self.nearbyModel)
+        nearbyLayout.addWidget(self.nearbyTable, 1, 0, 1, 10)
+        nearbyGroupBox.setLayout(nearbyLayout)
+        mainLayout.addWidget(nearbyGroupBox)
+
+        reviewSearchGroupBox = QGroupBox("Search Reviews (in zipcode and category)")
+        reviewSearchLayout = QGridLayout()
+        self.reviewSearchEdit = QLineEdit()
+        self.reviewSearchEdit.setPlaceholderText('Keywords, e.g. "happy hour" -loud')
+        self.reviewSearchEdit.returnPressed.connect(self.on_review_search)
+        reviewSearchButton = QPushButton("Search")
+        reviewSearchButton.clicked.connect(self.on_review_search)
+        self.reviewPrevButton = QPushButton("Previous")
+        self.reviewPrevButton.clicked.connect(lambda: self.load_review_page(self.reviewPage - 1))
+        self.reviewNextButton = QPushButton("Next")
+        self.reviewNextButton.clicked.connect(lambda: self.load_review_page(self.reviewPage + 1))
+        self.reviewPageLabel = QLabel("")
+        self.reviewPrevButton.setEnabled(False)
+        self.reviewNextButton.setEnabled(False)
+        self.reviewPage = 0
+        self.reviewSearch = None
+        for column, widget in enumerate((
+            self.reviewSearchEdit, reviewSearchButton, self.reviewPrevButton, self.reviewPageLabel, self.reviewNextButton,
+        )):
+            reviewSearchLayout.addWidget(widget, 0, column)
+        self.reviewResultsModel = RowTableModel(["Business", "Stars", "Date", "Rank", "Excerpt"])
+        self.reviewResultsTable = QTableView()
+        self.reviewResultsTable.setModel(self.reviewResultsModel)
+        self.reviewResultsTable.horizontalHeader().setStretchLastSection(True)
+        self.reviewBusinessesModel = RowTableModel(["Business", "Matching Reviews", "Score"])
+        self.reviewBusinessesTable = QTableView()
+        self.reviewBusinessesTable.setModel(self.reviewBusinessesModel)
+        reviewSearchLayout.addWidget(self.reviewResultsTable, 1, 0, 1, 4)
+        reviewSearchLayout.addWidget(self.reviewBusinessesTable, 1, 4, 1, 1)
+        reviewSearchGroupBox.setLayout(reviewSearchLayout)
+        mainLayout.addWidget(reviewSearchGroupBox)
+
+        friendsGroupBox = QGroupBox("Reviewed by My Friends")
+        friendsLayout = QGridLayout()
+        self.friendsUserEdit = QLineEdit()
+        self.friendsUserEdit.setPlaceholderText("Your user id")
+        self.friendsUserEdit.returnPressed.connect(self.on_friends_search)
+        self.friendsZipcodeCheckBox = QCheckBox("In selected zipcode")
+        friendsButton = QPushButton("Show")
+        friendsButton.clicked.connect(self.on_friends_search)
+        for column, widget in enumerate((self.friendsUserEdit, self.friendsZipcodeCheckBox, friendsButton)):
+            friendsLayout.addWidget(widget, 0, column)
+        self.friendsModel = RowTableModel(["Name", "City", "State", "Friends", "Friends' Stars", "Last Review"])
+        self.friendsTable = QTableView()
+        self.friendsTable.setModel(self.friendsModel)
+        friendsLayout.addWidget(self.friendsTable, 1, 0, 1, 3)
+        friendsGroupBox.setLayout(friendsLayout)
+        mainLayout.addWidget(friendsGroupBox)
+
+        # The snapshot only holds what the browsing panels above read
+        if SNAPSHOT_FILE:
+            for groupBox in (nearbyGroupBox, reviewSearchGroupBox, friendsGroupBox):
+                groupBox.setEnabled(False)
+                groupBox.setToolTip("Needs the database server; not available when browsing a snapshot")
         
         centralWidget = QWidget()
         centralWidget.setLayout(mainLayout)
         self.setCentralWidget(centralWidget)
 
-        self.load_states()
+    def run_query(self, slot, query, args, callback, cache=True, connection=None):
+        self.discard(slot)
+        worker = QueryWorker(
+            slot, self.generations[slot], query, args, callback, self.cache if cache else None, connection or self.connection
+        )
+        worker.signals.finished.connect(self.on_query_finished)
+        worker.signals.failed.connect(self.on_query_failed)
+        worker.submitted = time.perf_counter()
+        self.workers[slot] = worker
+        self.pool.start(worker)
+
+    def discard(self, *slots):
+        for slot in slots:
+            self.generations[slot] = self.generations.get(slot, 0) + 1
+            worker = self.workers.pop(slot, None)
+            if worker:
+                worker.cancel()
 
-    def load_states(self):
-        states = get_states(self.conn)
-        for state in states:
-            self.stateComboBox.addItem(state[0])
-        self.stateComboBox.activated[str].connect(self.on_state_changed) 
+    def on_query_finished(self, slot, generation, result):
+        worker = self.workers.get(slot)
+        if worker is None or worker.generation != generation:
+            return
+        del self.workers[slot]
+        started = time.perf_counter()
+        worker.callback(result)
+        finished = time.perf_counter()
+        record_timing(f"populate {slot}", finished - started)
+        record_timing(f"handler {slot}", finished - worker.submitted)
+        stats = self.cache.stats()
+        self.statusBar().showMessage(
+            f"Cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries"
+        )
+
+    def on_query_failed(self, slot, generation, message):
+        worker = self.workers.get(slot)
+        if worker is None or worker.generation != generation:
+            return
+        del self.workers[slot]
+        print(f"Query for {slot} failed: {message}")
+
+    def toggle_debug_panel(self):
+        self.debugPanel.setVisible(not self.debugPanel.isVisible())
 
+    def load_locations(self):
+        # States, cities and zipcodes all come from one in-memory tree: the cached one straight
+        # away, then a fresh one if the data version moved on since it was saved
+        if SNAPSHOT_FILE:
+            cache_path = source = None
+        else:
+            cache_path, source = LOCATIONS_CACHE, LOCATIONS_SOURCE
+            cached = LocationTree.load(cache_path, source)
+            if cached is not None:
+                self.show_locations(cached)
+        self.run_query(
+            "locations", refresh_locations,
+            (self.locations, self.queries.get_data_version, self.queries.get_locations, cache_path, source),
+            self.show_locations, cache=False
+        )
+
+    def show_locations(self, locations):
+        if locations is None:
+            return
+        self.locations = locations
+        state = self.stateComboBox.currentText()
+        self.stateComboBox.clear()
+        self.stateComboBox.addItems(locations.states())
+        if state in locations.tree:
+            self.stateComboBox.setCurrentText(state)
 
     def on_state_changed(self, state):
+        self.discard(*self.DEPENDENT_SLOTS["cities"])
         self.cityListWidget.clear()
         self.zipcodeListWidget.clear()
         self.filterListWidget.clear()
-        self.businessTable.setRowCount(0)  
-        cities = get_cities(self.conn, state)
-        for city in cities:
-            self.cityListWidget.addItem(city[0])
+        self.businessModel.clear()
+        self.cityListWidget.addItems(self.locations.cities(state))
 
     def on_city_selected(self):
         selected_items = self.cityListWidget.selectedItems()
         if selected_items:
             selected_city = selected_items[0].text()
             state = self.stateComboBox.currentText()
-            zipcodes = get_zipcodes(self.conn, selected_city, state)
+            self.discard(*self.DEPENDENT_SLOTS["zipcodes"])
             self.zipcodeListWidget.clear()
             self.filterListWidget.clear()
-            self.businessTable.setRowCount(0)  
-            for zipcode in zipcodes:
-                self.zipcodeListWidget.addItem(zipcode[0])
-
+            self.businessModel.clear()
+            self.zipcodeListWidget.addItems(self.locations.zipcodes(state, selected_city))
 
     def load_businesses(self, city, state):
-        self.businessTable.setRowCount(0)
-        businesses = get_businesses(self.conn, city, state)
-        for business in businesses:
-            row_position = self.businessTable.rowCount()
-            self.businessTable.insertRow(row_position)
-            self.businessTable.setItem(row_position, 0, QTableWidgetItem(business[0]))
-            self.businessTable.setItem(row_position, 1, QTableWidgetItem(business[1]))
-            self.businessTable.setItem(row_position, 2, QTableWidgetItem(business[2]))
+        self.businessModel.query(self.queries.get_businesses, (city, state))
 
     def on_zipcode_selected(self):
         selected_items = self.zipcodeListWidget.selectedItems()
         if selected_items:
             selected_zipcode = selected_items[0].text()
-            
+
             # Clear previous data
+            self.discard(*self.DEPENDENT_SLOTS["zipcode_dashboard"])
             self.filterListWidget.clear()
+            self.businessModel.clear()
             self.statsTable.clearContents()
-            self.categoriesTable.clearContents()
+            self.categoriesModel.clear()
+
+            # Category filter list, zipcode statistics and top categories all come from one query
+            self.run_query("zipcode_dashboard", self.queries.get_zipcode_dashboard, (selected_zipcode,), self.show_zipcode_dashboard)
 
-            # Load categories for the filterCategory table
-            categories = get_categories(self.conn, selected_zipcode)
-            for category in categories:
-                self.filterListWidget.addItem(category[0])
+    def show_zipcode_dashboard(self, dashboard):
+        self.show_categories(dashboard["categories"])
+        self.show_zipcode_stats(dashboard["stats"])
+        self.show_top_categories(dashboard["top_categories"])
 
-            # Populate the number of businesses in zipcode statistics table
-            self.update_zipcode_stats(selected_zipcode)
-            
-            # Fill in the top categories table
-            self.update_top_categories(selected_zipcode)
+    def show_categories(self, categories):
+        for category in categories:
+            self.filterListWidget.addItem(category[0])
 
     def on_category_selected(self):
         selected_items = self.filterListWidget.selectedItems()
@@ -252,24 +1008,17 @@ class MyApp(QMainWindow):
             if selected_zipcode_items:
                 selected_zipcode = selected_zipcode_items[0].text()
                 self.load_businesses_by_category(selected_zipcode, selected_category)
-                self.update_popular_businesses(selected_zipcode, selected_category)
-                self.update_successful_businesses(selected_zipcode, selected_category)
+                self.run_query(
+                    "category_dashboard", self.queries.get_category_dashboard, (selected_zipcode, selected_category),
+                    self.show_category_dashboard
+                )
+
+    def show_category_dashboard(self, dashboard):
+        self.show_popular_businesses(dashboard["popular"])
+        self.show_successful_businesses(dashboard["successful"])
 
     def load_businesses_by_category(self, zipcode, category):
-        # Assuming this method already exists and works properly
-        # Fetch businesses matching the selected category and zipcode
-        businesses = get_businesses_by_category(self.conn, zipcode, category)
-        self.businessTable.setRowCount(0)  # Clear existing rows
-        for business in businesses:
-            row_position = self.businessTable.rowCount()
-            self.businessTable.insertRow(row_position)
-            # Assuming business has attributes: name, city, state, stars, review_count, review_rating
-            for i, property in enumerate(business):
-                if i == 7:  # Assuming index 7 is a boolean for "is_open"
-                    property = "Yes" if property else "No"
-                elif i == 8:  # Assuming index 8 is a dictionary for "hours"
-                    property = json.dumps(property) if isinstance(property, dict) else property
-                self.businessTable.setItem(row_position, i, QTableWidgetItem(str(property)))
+        self.businessModel.query(self.queries.get_businesses_by_category, (zipcode, category))
 
     def on_search_clicked(self):
         state = self.stateComboBox.currentText()
@@ -277,93 +1026,133 @@ class MyApp(QMainWindow):
         city = city_item.text() if city_item else None
         zipcode_item = self.zipcodeListWidget.currentItem()
         zipcode = zipcode_item.text() if zipcode_item else None
-        
+        category_item = self.filterListWidget.currentItem()
+
         if city and zipcode:
             self.load_businesses(city, state)
             self.update_zipcode_stats(zipcode)
-            self.update_popular_businesses(zipcode)
-            self.update_successful_businesses(zipcode)
+            if category_item:
+                self.update_popular_businesses(zipcode, category_item.text())
+                self.update_successful_businesses(zipcode, category_item.text())
         else:
             # Handle case where city or zipcode is not selected
             pass
 
-    
     def update_zipcode_stats(self, zipcode):
-        # Query the database for the number of businesses in the zipcode
-        with self.conn.cursor() as cur:
-            cur.execute("""
-                SELECT COUNT(*)
-                FROM businesses
-                WHERE postal_code = %s;
-            """, (zipcode,))
-            business_count = cur.fetchone()[0]
-            
-            # Assume the first row is dedicated to the statistics
-            self.statsTable.setItem(0, 0, QTableWidgetItem(str(business_count)))
-
-            # ... Include additional code to populate the total population and average income ...
+        # ZipcodeStats is maintained by populate.py, so this is a single primary-key lookup
+        self.run_query("stats", self.queries.get_zipcode_stats, (zipcode,), self.show_zipcode_stats)
+
+    def show_zipcode_stats(self, stats):
+        if stats:
+            for i, value in enumerate(stats):
+                self.statsTable.setItem(0, i, QTableWidgetItem("" if value is None else str(value)))
 
-        
-    
     def update_popular_businesses(self, zipcode, category):
-        with self.conn.cursor() as cur:
-            # Modify the query to include category filtering
-            cur.execute("""
-                SELECT name, stars, review_count
-                FROM businesses
-                WHERE postal_code = %s AND categories LIKE %s
-                ORDER BY review_count DESC
-                LIMIT 5;
-            """, (zipcode, '%' + category + '%',))
-            businesses = cur.fetchall()
-            self.popularBusinessTable.setRowCount(0)
-            for business in businesses:
-                row_position = self.popularBusinessTable.rowCount()
-                self.popularBusinessTable.insertRow(row_position)
-                for i, value in enumerate(business):
-                    self.popularBusinessTable.setItem(row_position, i, QTableWidgetItem(str(value)))
+        self.run_query("popular", self.queries.get_popular_businesses, (zipcode, category), self.show_popular_businesses)
+
+    def show_popular_businesses(self, businesses):
+        self.popularBusinessTable.setRowCount(0)
+        for business in businesses:
+            row_position = self.popularBusinessTable.rowCount()
+            self.popularBusinessTable.insertRow(row_position)
+            for i, value in enumerate(business):
+                self.popularBusinessTable.setItem(row_position, i, QTableWidgetItem(str(value)))
 
     def update_successful_businesses(self, zipcode, category):
-        with self.conn.cursor() as cur:
-            # Modify the query to include category filtering
-            cur.execute("""
-                SELECT review_count, "numCheckins"
-                FROM businesses
-                WHERE postal_code = %s AND categories LIKE %s
-                ORDER BY "numCheckins" DESC
-                LIMIT 5;
-            """, (zipcode, '%' + category + '%',))
-            businesses = cur.fetchall()
-            self.successfulBusinessTable.setRowCount(0)
-            for business in businesses:
-                row_position = self.successfulBusinessTable.rowCount()
-                self.successfulBusinessTable.insertRow(row_position)
-                for i, value in enumerate(business):
-                    self.successfulBusinessTable.setItem(row_position, i, QTableWidgetItem(str(value)))
-
-
-    
+        self.run_query("successful", self.queries.get_successful_businesses, (zipcode, category), self.show_successful_businesses)
+
+    def show_successful_businesses(self, businesses):
+        self.successfulBusinessTable.setRowCount(0)
+        for business in businesses:
+            row_position = self.successfulBusinessTable.rowCount()
+            self.successfulBusinessTable.insertRow(row_position)
+            for i, value in enumerate(business):
+                self.successfulBusinessTable.setItem(row_position, i, QTableWidgetItem(str(value)))
+
     def update_top_categories(self, zipcode):
-        # Assuming categories are stored in a single column separated by commas
-        with self.conn.cursor() as cur:
-            cur.execute("""
-                SELECT UNNEST(string_to_array(categories, ', ')) AS category, COUNT(*) 
-                FROM businesses 
-                WHERE postal_code = %s
-                GROUP BY UNNEST(string_to_array(categories, ', '))
-                ORDER BY COUNT(*) DESC;
-            """, (zipcode,))
-            categories = cur.fetchall()
-            
-            # Populate the categoriesTable with the categories and their business counts
-            self.categoriesTable.setRowCount(len(categories))
-            for i, (category, count) in enumerate(categories):
-                self.categoriesTable.setItem(i, 0, QTableWidgetItem(category))
-                self.categoriesTable.setItem(i, 1, QTableWidgetItem(str(count)))
+        self.run_query("top_categories", self.queries.get_top_categories, (zipcode,), self.show_top_categories)
+
+    def show_top_categories(self, categories):
+        self.categoriesModel.set_rows(categories)
+
+    def spatial_index(self):
+        # numpy and the grid are only loaded once Near Me is first used
+        if self.spatial is None:
+            from spatial import SpatialIndex
+            self.spatial = SpatialIndex()
+        return self.spatial
+
+    def nearby_filters(self):
+        return (
+            self.nearbyCountSpinBox.value(), self.nearbyRadiusSpinBox.value() or None,
+            self.nearbyCategoryEdit.text().strip() or None, self.nearbyOpenCheckBox.isChecked(),
+        )
+
+    def on_near_point(self):
+        try:
+            lat, lon = float(self.latitudeEdit.text()), float(self.longitudeEdit.text())
+        except ValueError:
+            self.statusBar().showMessage("Enter a latitude and longitude")
+            return
+        self.run_query("nearby", self.spatial_index().search, (lat, lon) + self.nearby_filters(), self.show_nearby, cache=False)
+
+    def on_near_business(self):
+        index = self.businessTable.currentIndex()
+        row = self.businessModel.rows[index.row()] if index.isValid() else None
+        if not row or len(row) < 10:
+            self.statusBar().showMessage("Select a business first")
+            return
+        self.run_query("nearby", self.spatial_index().near_business, (row[9],) + self.nearby_filters(), self.show_nearby, cache=False)
+
+    def on_review_search(self):
+        keywords = self.reviewSearchEdit.text().strip()
+        zipcode_item = self.zipcodeListWidget.currentItem()
+        category_item = self.filterListWidget.currentItem()
+        if not keywords or not zipcode_item:
+            self.statusBar().showMessage("Select a zipcode and enter keywords to search reviews")
+            return
+        self.reviewSearch = (zipcode_item.text(), category_item.text() if category_item else None, keywords)
+        self.load_review_page(0)
+
+    def load_review_page(self, page):
+        if self.reviewSearch is None or page < 0:
+            return
+        self.reviewPrevButton.setEnabled(False)
+        self.reviewNextButton.setEnabled(False)
+        self.run_query("review_search", search_reviews, self.reviewSearch + (page,), self.show_review_results)
+
+    def show_review_results(self, results):
+        self.reviewPage = results["page"]
+        self.reviewResultsModel.set_rows(results["reviews"])
+        self.reviewBusinessesModel.set_rows(results["businesses"])
+        self.reviewPageLabel.setText(f"Page {self.reviewPage + 1}")
+        self.reviewPrevButton.setEnabled(self.reviewPage > 0)
+        self.reviewNextButton.setEnabled(results["has_more"])
+
+    def on_friends_search(self):
+        user_id = self.friendsUserEdit.text().strip()
+        if not user_id:
+            self.statusBar().showMessage("Enter your user id")
+            return
+        zipcode_item = self.zipcodeListWidget.currentItem()
+        if self.friendsZipcodeCheckBox.isChecked() and not zipcode_item:
+            self.statusBar().showMessage("Select a zipcode first")
+            return
+        zipcode = zipcode_item.text() if self.friendsZipcodeCheckBox.isChecked() else None
+        self.run_query("friends_businesses", get_friends_businesses, (user_id, zipcode), self.show_friends_businesses)
+
+    def show_friends_businesses(self, businesses):
+        self.friendsModel.set_rows(businesses)
+
+    def show_nearby(self, businesses):
+        # Drop business_id; the model shows name, city, state, stars, is_open, distance
+        self.nearbyModel.set_rows([business[1:] for business in businesses])
 
 
 if __name__ == '__main__':
     app = QApplication([])
     ex = MyApp()
     ex.show()
-    app.exec_()
\ No newline at end of file
+    app.exec_()
+    if TIMINGS_FILE:
+        dump_timings(TIMINGS_FILE)
@@ -0,0 +1,138 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import concurrent.futures
+import requests
+
+# Point CENSUS_API_BASE at a local stand-in server to run imports without api.census.gov
+API_BASE = os.environ.get("CENSUS_API_BASE", "https://api.census.gov")
+CENSUS_PATHS = {
+    "population": "/data/2020/acs/acs5?get=NAME,B01003_001E&for=zip%20code%20tabulation%20area:*",
+    "income": "/data/2020/acs/acs5/subject?get=NAME,S1903_C03_001E&for=zip%20code%20tabulation%20area:*",
+}
+
+# Kept out of the checkout, in the user's cache directory (~/.cache/milestone1/census by default)
+CACHE_DIR = os.environ.get("CENSUS_CACHE_DIR", os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "milestone1", "census"
+))
+CACHE_TTL = float(os.environ.get("CENSUS_CACHE_TTL", 30 * 24 * 3600))
+TIMEOUT = float(os.environ.get("CENSUS_TIMEOUT", 30))
+RETRIES = 3
+
+
+def census_urls(api_base=API_BASE):
+    return {name: api_base.rstrip('/') + path for name, path in CENSUS_PATHS.items()}
+
+
+def cache_path(url):
+    return os.path.join(CACHE_DIR, hashlib.sha256(url.encode()).hexdigest() + ".json")
+
+
+def read_cache(url):
+    # A cache file whose body no longer matches its hash is treated as missing
+    try:
+        with open(cache_path(url)) as file:
+            entry = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if entry.get("url") != url or hashlib.sha256(entry.get("body", "").encode()).hexdigest() != entry.get("sha256"):
+        return None
+    return entry
+
+
+def write_cache(url, body, etag=None, last_modified=None):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    entry = {
+        "url": url, "fetched_at": time.time(), "etag": etag, "last_modified": last_modified,
+        "sha256": hashlib.sha256(body.encode()).hexdigest(), "body": body,
+    }
+    path = cache_path(url)
+    with open(path + ".tmp", 'w') as file:
+        json.dump(entry, file)
+    os.replace(path + ".tmp", path)
+    return entry
+
+
+def rows(body):
+    # The API answers with a header row followed by the data rows
+    return json.loads(body)[1:]
+
+
+def fetch(url, session=None, offline=False, ttl=CACHE_TTL):
+    # Returns the data rows for url from a fresh cache entry, the server (revalidating with
+    # ETag/Last-Modified), or a stale cache entry when the server cannot be reached; None if none worked
+    entry = read_cache(url)
+    if entry and (offline or time.time() - entry["fetched_at"] < ttl):
+        return rows(entry["body"])
+    if offline:
+        return None
+    session = session or requests.Session()
+    headers = {}
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    for attempt in range(RETRIES):
+        try:
+            response = session.get(url, headers=headers, timeout=TIMEOUT)
+        except requests.RequestException as e:
+            error = str(e)
+        else:
+            if response.status_code == 304 and entry:
+                entry = write_cache(url, entry["body"], entry.get("etag"), entry.get("last_modified"))
+                return rows(entry["body"])
+            if response.status_code == 200:
+                try:
+                    data = rows(response.text)
+                except ValueError as e:
+                    error = f"bad response: {e}"
+                else:
+                    write_cache(url, response.text, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+                    return data
+            else:
+                error = f"HTTP {response.status_code}"
+                if response.status_code < 500 and response.status_code != 429:
+                    break
+        if attempt + 1 < RETRIES:
+            time.sleep(2 ** attempt)
+    if entry:
+        print(f"Census fetch failed ({error}), using the copy cached {time.ctime(entry['fetched_at'])}")
+        return rows(entry["body"])
+    print(f"Census fetch failed: {error}")
+    return None
+
+
+def load_snapshot(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_snapshot(path, data):
+    with open(path, 'w') as file:
+        json.dump(data, file)
+
+
+def load_census(offline=False, snapshot=None, api_base=API_BASE):
+    # {"population": rows, "income": rows}, fetching both tables at once. A snapshot file
+    # is used when given, and fills in whatever neither the network nor the cache could provide.
+    if snapshot and offline:
+        return load_snapshot(snapshot)
+    urls = census_urls(api_base)
+    with requests.Session() as session, concurrent.futures.ThreadPoolExecutor(len(urls)) as pool:
+        futures = {name: pool.submit(fetch, url, session, offline) for name, url in urls.items()}
+        data = {name: future.result() for name, future in futures.items()}
+    if snapshot and any(value is None for value in data.values()):
+        saved = load_snapshot(snapshot)
+        data = {name: saved.get(name, []) if value is None else value for name, value in data.items()}
+    return {name: value or [] for name, value in data.items()}
+
+
+if __name__ == "__main__":
+    # python census.py snapshot.json -- save both tables for offline imports
+    if len(sys.argv) != 2:
+        sys.exit("usage: python census.py SNAPSHOT_FILE")
+    data = load_census()
+    save_snapshot(sys.argv[1], data)
+    print(f"Saved {len(data['population'])} population and {len(data['income'])} income rows to {sys.argv[1]}")
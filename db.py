@@ -0,0 +1,213 @@
+import os
+import re
+import json
+import time
+import bisect
+import threading
+import contextlib
+import collections
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+DB_CONFIG = {
+    "dbname": os.environ.get("PGDATABASE", "milestone1db"),
+    "user": os.environ.get("PGUSER", "postgres"),
+    "password": os.environ.get("PGPASSWORD", "admin"),
+    "host": os.environ.get("PGHOST", "localhost"),
+    "port": os.environ.get("PGPORT", "5432"),
+}
+
+POOL_MIN = int(os.environ.get("DB_POOL_MIN", 1))
+POOL_MAX = int(os.environ.get("DB_POOL_MAX", 8))
+
+# Statements slower than this are logged with their EXPLAIN plan
+SLOW_QUERY_MS = float(os.environ.get("DB_SLOW_QUERY_MS", 250))
+# Percentiles and histograms cover the most recent samples of each timing
+TIMING_WINDOW = 1000
+HISTOGRAM_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+# Row order of the 7x24 CheckinHours.hours array
+DAYS = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+
+
+class Connection(psycopg2.extensions.connection):
+    # Remembers which statements have been PREPAREd in this session
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+def connect_db(**overrides):
+    try:
+        return psycopg2.connect(connection_factory=Connection, **{**DB_CONFIG, **overrides})
+    except Exception as e:
+        print(f"Database connection error: {e}")
+        return None
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = psycopg2.pool.ThreadedConnectionPool(POOL_MIN, POOL_MAX, connection_factory=Connection, **DB_CONFIG)
+        return _pool
+
+
+@contextlib.contextmanager
+def pooled_connection(autocommit=True):
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        conn.autocommit = autocommit
+        yield conn
+    finally:
+        if not conn.closed and not conn.autocommit:
+            conn.rollback()
+        pool.putconn(conn, close=bool(conn.closed))
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+def get_data_version(conn):
+    # DataVersion.generation, bumped by every populate run; None before the first one
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT generation FROM dataversion;")
+            row = cur.fetchone()
+            return row[0] if row else None
+    except psycopg2.Error:
+        conn.rollback()
+        return None
+
+
+_statements = {}
+_timings = collections.defaultdict(lambda: [0, 0.0, 0.0, collections.deque(maxlen=TIMING_WINDOW)])
+_timings_lock = threading.Lock()
+_slow_queries = collections.deque(maxlen=100)
+
+
+def to_positional(sql):
+    # PREPARE wants $n placeholders; keep the %s / %(name)s style used everywhere else
+    names = list(dict.fromkeys(re.findall(r"%\((\w+)\)s", sql)))
+    if names:
+        return re.sub(r"%\((\w+)\)s", lambda m: f"${names.index(m.group(1)) + 1}", sql), names
+    counter = iter(range(1, sql.count("%s") + 1))
+    return re.sub(r"%s", lambda m: f"${next(counter)}", sql), None
+
+
+def record_timing(name, seconds):
+    with _timings_lock:
+        timing = _timings[name]
+        timing[0] += 1
+        timing[1] += seconds
+        timing[2] = max(timing[2], seconds)
+        timing[3].append(seconds)
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def histogram(samples):
+    counts = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+    for seconds in samples:
+        counts[bisect.bisect_left(HISTOGRAM_BUCKETS_MS, seconds * 1000)] += 1
+    labels = [f"<={bound}ms" for bound in HISTOGRAM_BUCKETS_MS] + [f">{HISTOGRAM_BUCKETS_MS[-1]}ms"]
+    return dict(zip(labels, counts))
+
+
+def statement_timings():
+    # calls/total/mean/max are for the whole session; p50/p95/p99 and the histogram for the rolling window
+    with _timings_lock:
+        timings = {name: (calls, total, worst, sorted(samples)) for name, (calls, total, worst, samples) in _timings.items()}
+    return {
+        name: {
+            "calls": calls, "total": total, "mean": total / calls, "max": worst,
+            "p50": percentile(ordered, 0.5), "p95": percentile(ordered, 0.95), "p99": percentile(ordered, 0.99),
+            "histogram": histogram(ordered),
+        }
+        for name, (calls, total, worst, ordered) in timings.items()
+    }
+
+
+def slow_queries():
+    with _timings_lock:
+        return list(_slow_queries)
+
+
+def reset_timings():
+    with _timings_lock:
+        _timings.clear()
+        _slow_queries.clear()
+
+
+def dump_timings(path):
+    with open(path, 'w') as file:
+        json.dump({
+            "dumped_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "slow_query_ms": SLOW_QUERY_MS,
+            "timings": statement_timings(),
+            "slow_queries": slow_queries(),
+        }, file, indent=2, default=str)
+
+
+def explain(conn, sql, params):
+    # Runs in a savepoint so a failing EXPLAIN cannot abort the caller's transaction
+    try:
+        with conn.cursor() as cur:
+            if not conn.autocommit:
+                cur.execute("SAVEPOINT explain_slow_query;")
+            try:
+                cur.execute(f"EXPLAIN {sql}", params or None)
+                return "\n".join(row[0] for row in cur.fetchall())
+            finally:
+                if not conn.autocommit:
+                    cur.execute("ROLLBACK TO SAVEPOINT explain_slow_query; RELEASE SAVEPOINT explain_slow_query;")
+    except psycopg2.Error as e:
+        return f"EXPLAIN failed: {str(e).strip()}"
+
+
+def log_slow_query(conn, name, seconds, sql, params):
+    plan = explain(conn, sql, params)
+    print(f"Slow query {name}: {seconds * 1000:.0f} ms")
+    with _timings_lock:
+        _slow_queries.append({
+            "name": name, "ms": round(seconds * 1000, 3), "at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "params": [str(value) for value in (params.values() if isinstance(params, dict) else params or ())],
+            "plan": plan,
+        })
+
+
+def execute(cur, name, sql, params=()):
+    # Runs sql as the server-side prepared statement `name`, preparing it the first time
+    # this connection sees it. Connections not made by connect_db fall back to a plain execute.
+    started = time.perf_counter()
+    prepared = getattr(cur.connection, "prepared", None)
+    if prepared is None:
+        cur.execute(sql, params or None)
+        statement, values = sql, params
+    else:
+        if name not in _statements:
+            _statements[name] = to_positional(sql.strip().rstrip(";"))
+        text, names = _statements[name]
+        if name not in prepared:
+            cur.execute(f"PREPARE {name} AS {text}")
+            prepared.add(name)
+        values = [params[n] for n in names] if names else list(params)
+        statement = f"EXECUTE {name} ({', '.join(['%s'] * len(values))})" if values else f"EXECUTE {name}"
+        cur.execute(statement, values or None)
+    elapsed = time.perf_counter() - started
+    record_timing(name, elapsed)
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        log_slow_query(cur.connection, name, elapsed, statement, values)
@@ -1,23 +1,26 @@
+import io
+import re
+import collections
+import os
+import sys
 import json
+import time
+import argparse
+import resource
+import concurrent.futures
+import multiprocessing
 import psycopg2
+import psycopg2.extras
 import datetime
-import requests
-
-def connect_db():
-    try:
-        return psycopg2.connect(
-            dbname="milestone1db",
-            user="postgres",
-            password="admin",
-            host="localhost"
-        )
-    except Exception as e:
-        print(f"Database connection error: {e}")
-        return None
-
-def cleanStr4SQL(s):
-    return s.replace("'", "''")
+import numpy as np
+from db import connect_db, record_timing, statement_timings, DAYS
+from census import load_census
+from snapshot import export_snapshot
+from schema import create_tables, drop_secondary_indexes, build_secondary_indexes, INDEX_WORKERS
 
+AGE_WEIGHT = 0.3
+CHECKIN_WEIGHT = 0.4
+REVIEW_WEIGHT = 0.3
 
 def calculate_business_age(registration_date):
     today = datetime.datetime.now()
@@ -25,188 +28,1149 @@ def calculate_business_age(registration_date):
     return age
 
 def calculate_success_score(age, repeat_checkins, positive_reviews, total_checkins, total_reviews):
-    age_weight = 0.3
-    checkin_weight = 0.4
-    review_weight = 0.3
-
     repeat_checkin_rate = repeat_checkins / total_checkins if total_checkins > 0 else 0
     positive_review_rate = positive_reviews / total_reviews if total_reviews > 0 else 0
 
-    return (age_weight * age) + (checkin_weight * repeat_checkin_rate) + (review_weight * positive_review_rate)
+    return (AGE_WEIGHT * age) + (CHECKIN_WEIGHT * repeat_checkin_rate) + (REVIEW_WEIGHT * positive_review_rate)
 
 
-def fetch_data_from_census(api_url):
-    response = requests.get(api_url)
-    return response.json()[1:] if response.status_code == 200 else []
+def score_businesses(registration_dates, repeat_checkins, positive_reviews, total_checkins, total_reviews, today=None):
+    # Array version of calculate_business_age + calculate_success_score for a whole chunk of businesses
+    today = np.datetime64(today or datetime.date.today(), 'D')
+    dates = np.asarray(registration_dates, dtype='datetime64[D]')
+    months = dates.astype('datetime64[M]')
+    year = dates.astype('datetime64[Y]').astype(np.int64) + 1970
+    month = months.astype(np.int64) % 12 + 1
+    day = (dates - months).astype(np.int64) + 1
+    today_year = today.astype('datetime64[Y]').astype(np.int64) + 1970
+    today_month = today.astype('datetime64[M]').astype(np.int64) % 12 + 1
+    today_day = (today - today.astype('datetime64[M]')).astype(np.int64) + 1
+    before_anniversary = (today_month < month) | ((today_month == month) & (today_day < day))
+    age = today_year - year - before_anniversary
 
+    repeat_checkins = np.asarray(repeat_checkins, dtype=np.float64)
+    positive_reviews = np.asarray(positive_reviews, dtype=np.float64)
+    total_checkins = np.asarray(total_checkins, dtype=np.float64)
+    total_reviews = np.asarray(total_reviews, dtype=np.float64)
+    repeat_checkin_rate = np.divide(repeat_checkins, total_checkins, out=np.zeros_like(repeat_checkins), where=total_checkins > 0)
+    positive_review_rate = np.divide(positive_reviews, total_reviews, out=np.zeros_like(positive_reviews), where=total_reviews > 0)
 
-def fetch_and_process_census_data():
-    conn = connect_db()
-    if not conn:
-        return
+    return age, AGE_WEIGHT * age + CHECKIN_WEIGHT * repeat_checkin_rate + REVIEW_WEIGHT * positive_review_rate
 
-    population_url = "https://api.census.gov/data/2020/acs/acs5?get=NAME,B01003_001E&for=zip%20code%20tabulation%20area:*"
-    income_url = "https://api.census.gov/data/2020/acs/acs5/subject?get=NAME,S1903_C03_001E&for=zip%20code%20tabulation%20area:*"
 
-    population_data = fetch_data_from_census(population_url)
-    income_data = fetch_data_from_census(income_url)
+def combine_census_data(census):
+    zip_population = {row[4]: int(row[2]) for row in census["population"]}
+    zip_income = {row[3]: float(row[2]) for row in census["income"] if row[1] != "-666666666"}
 
-    zip_population = {row[4]: int(row[2]) for row in population_data}
-    zip_income = {row[3]: float(row[2]) for row in income_data if row[1] != "-666666666"}
+    return [(zip_code, zip_population.get(zip_code, 0), zip_income.get(zip_code, 0.0)) for zip_code in set(zip_population) | set(zip_income)]
 
-    combined_data = [(zip_code, zip_population.get(zip_code, 0), zip_income.get(zip_code, 0.0)) for zip_code in set(zip_population) | set(zip_income)]
-    insert_data_into_db(conn, combined_data)
-    conn.close()
 
+def fetch_and_process_census_data(conn, offline=False, snapshot=None):
+    return insert_data_into_db(conn, combine_census_data(load_census(offline, snapshot)))
 
 
 def insert_data_into_db(conn, data):
+    # Unchanged zipcodes are left alone, and only inserted or changed ones are queued for ZipcodeStats
+    if not data:
+        return 0
     with conn.cursor() as cursor:
-        # cursor.execute("""
-        #     CREATE TABLE IF NOT EXISTS Zipcodes (
-        #         zip_code VARCHAR(5) PRIMARY KEY,
-        #         population INT,
-        #         avg_income NUMERIC(10, 1)
-        #     );
-        # """)
-        psycopg2.extras.execute_values(cursor, """
+        changed = psycopg2.extras.execute_values(cursor, """
             INSERT INTO Zipcodes (zip_code, population, avg_income) VALUES %s
             ON CONFLICT (zip_code) DO UPDATE SET
             population = EXCLUDED.population,
-            avg_income = EXCLUDED.avg_income;
-        """, data)
+            avg_income = EXCLUDED.avg_income
+            WHERE (Zipcodes.population, Zipcodes.avg_income) IS DISTINCT FROM (EXCLUDED.population, EXCLUDED.avg_income)
+            RETURNING zip_code;
+        """, data, fetch=True)
+        if changed:
+            psycopg2.extras.execute_values(cursor, """
+                INSERT INTO StaleZipcodes (zip_code) VALUES %s ON CONFLICT DO NOTHING;
+            """, changed)
         conn.commit()
+    return len(changed)
 
-def import_business_data(json_file_path, connection):
-    with connection.cursor() as cursor, open(json_file_path, 'r', encoding='utf-8') as file:
-        for line in file:
-            data = json.loads(line)
-            registration_date = datetime.datetime.strptime(data.get("registration_date", "2000-01-01"), "%Y-%m-%d")
-            business_age = calculate_business_age(registration_date)
-            repeat_checkins = data.get("repeat_checkins", 0)
-            positive_reviews = data.get("positive_reviews", 0)
-            total_checkins = data.get("total_checkins", 1)
-            total_reviews = data.get("total_reviews", 1)  
-
-            success_score = calculate_success_score(business_age, repeat_checkins, positive_reviews, total_checkins, total_reviews)
-
-            # Additional business data parsing
-            attributes = json.dumps(data.get("attributes", {}))
-            hours = json.dumps(data.get("hours", {}))
-            is_open = 'TRUE' if data["is_open"] else 'FALSE'
-            
-            categories = data.get("categories", "")
-            if isinstance(categories, list):
-                categories = ', '.join(categories)  
-            categories = cleanStr4SQL(categories)  
-
-            sql = f"""
-            INSERT INTO Businesses (
-                business_id, name, neighborhood, address, city, state, postal_code,
-                latitude, longitude, stars, review_count, is_open, attributes, categories, hours, numCheckins, reviewrating, business_age, success_score
-            ) VALUES (
-                '{data["business_id"]}', '{cleanStr4SQL(data["name"])}', '{cleanStr4SQL(data.get("neighborhood", ""))}',
-                '{cleanStr4SQL(data["address"])}', '{data["city"]}', '{data["state"]}',
-                '{data["postal_code"]}', {data["latitude"]}, {data["longitude"]},
-                {data["stars"]}, {data["review_count"]}, {is_open},
-                '{attributes}', '{categories}', '{hours}', {total_checkins}, 0.0, {business_age}, {success_score}
-            ) ON CONFLICT (business_id) DO UPDATE SET
+BATCH_SIZE = 50000
+
+TABLES = {
+    "Businesses": {
+        "columns": (
+            "business_id", "name", "neighborhood", "address", "city", "state", "postal_code",
+            "latitude", "longitude", "stars", "review_count", "is_open", "attributes", "categories",
+            "hours", "numCheckins", "reviewrating", "business_age", "success_score",
+            "registration_date", "repeat_checkins", "positive_reviews", "total_reviews"
+        ),
+        "prepare": lambda cursor, rows: score_business_rows(rows),
+        "merge": """
+            SELECT DISTINCT ON (business_id) {columns} FROM {stage}
+            ON CONFLICT (business_id) DO UPDATE SET
+                categories = EXCLUDED.categories,
                 business_age = EXCLUDED.business_age,
-                success_score = EXCLUDED.success_score;
-            """
-            try:
-                cursor.execute(sql)
-            except Exception as e:
-                print(f"Failed to insert data: {e}")
-                connection.rollback()
-        connection.commit()
+                success_score = EXCLUDED.success_score,
+                loaded_at = now();
+        """,
+        # Their zipcodes are queued by the parent once the file is in (queue_business_zipcodes)
+        "after": (
+            # The business's category rows follow in the same batch and replace whatever it had before,
+            # as the upsert does for its categories text, which Near Me filters on
+            "DELETE FROM BusinessCategories c USING {stage} s WHERE c.business_id = s.business_id;",
+        ),
+    },
+    "BusinessCategories": {
+        "columns": ("business_id", "category"),
+        "merge": "SELECT DISTINCT {columns} FROM {stage} ON CONFLICT DO NOTHING;",
+    },
+    "CheckIns": {
+        "columns": ("business_id", "day", "hour", "count"),
+        "references": (("business_id", "Businesses"),),
+        "merge": "SELECT {columns} FROM {stage} ON CONFLICT DO NOTHING;",
+        "rollup": ("business_id, count", "SELECT business_id, count, 0, 0, 0 FROM merged"),
+    },
+    "CheckinHours": {
+        "columns": ("business_id", "hours", "total"),
+        "references": (("business_id", "Businesses"),),
+        "merge": """
+            SELECT DISTINCT ON (business_id) {columns} FROM {stage}
+            ON CONFLICT (business_id) DO UPDATE SET hours = EXCLUDED.hours, total = EXCLUDED.total;
+        """,
+        # A reloaded business replaces its total, so only the difference is added; the outer
+        # query still sees CheckinHours as it was before the merge
+        "rollup": ("business_id, total", """
+            SELECT m.business_id, m.total - COALESCE(h.total, 0), 0, 0, 0
+            FROM merged m LEFT JOIN CheckinHours h ON h.business_id = m.business_id
+        """),
+    },
+    "Reviews": {
+        "columns": (
+            "review_id", "user_id", "business_id", "stars", "date", "text", "useful", "funny", "cool"
+        ),
+        "references": (("business_id", "Businesses"), ("user_id", "Users")),
+        # No conflict target: a date-partitioned Reviews has (review_id, date) as its key
+        "merge": "SELECT {columns} FROM {stage} ON CONFLICT DO NOTHING;",
+        "rollup": ("business_id, stars", "SELECT business_id, 0, stars, 1, (stars >= 4)::int FROM merged"),
+    },
+    "Users": {
+        "columns": (
+            "user_id", "name", "review_count", "average_stars", "useful", "funny", "cool",
+            "elite", "fans", "compliment_cool", "compliment_cute", "compliment_funny",
+            "compliment_hot", "compliment_list", "compliment_more", "compliment_note", "compliment_photos",
+            "compliment_plain", "compliment_profile", "compliment_writer", "yelping_since"
+        ),
+        "merge": "SELECT {columns} FROM {stage} ON CONFLICT (user_id) DO NOTHING;",
+    },
+    # Parsed as (user_id, friend_id) pairs; prepare swaps both for their UserIds keys
+    "Friends": {
+        "columns": ("user_key", "friend_key"),
+        "prepare": lambda cursor, rows: friend_edges(rows),
+        "merge": "SELECT DISTINCT {columns} FROM {stage} ON CONFLICT DO NOTHING;",
+    },
+}
 
+# Per-process cache of UserIds keys; it starts over once it reaches USER_KEY_CACHE ids,
+# so a large friends graph costs at most that much loader memory
+USER_KEY_CACHE = int(os.environ.get("USER_KEY_CACHE", 1000000))
+_user_keys = {}
+_intern_conn = None
 
-def import_checkin_data(json_file_path, connection):
-    with connection.cursor() as cursor, open(json_file_path, 'r', encoding='utf-8') as file:
-        for line in file:
-            data = json.loads(line)
-            business_id = data['business_id']
-            for day, times in data['time'].items():
-                for hour, count in times.items():
-                    sql = f"""
-                    INSERT INTO CheckIns (business_id, day, hour, count) VALUES 
-                    ('{business_id}', '{day}', '{hour}', {count})
-                    ON CONFLICT DO NOTHING;
-                    """
-                    try:
-                        cursor.execute(sql)
-                    except Exception as e:
-                        print(f"Failed to insert check-in data: {e}")
-                        connection.rollback()
-        connection.commit()
 
+def intern_user_ids(user_ids):
+    # New ids are committed at once on a separate autocommit connection, so loaders with
+    # overlapping friends never wait for each other's batches; a key whose batch is rolled
+    # back afterwards is just unused
+    global _intern_conn
+    missing = set(user_ids).difference(_user_keys)
+    if len(_user_keys) + len(missing) > USER_KEY_CACHE:
+        _user_keys.clear()
+        missing = set(user_ids)
+    if missing:
+        if _intern_conn is None or _intern_conn.closed:
+            _intern_conn = connect_db()
+            _intern_conn.autocommit = True
+        # Sorted so workers adding overlapping ids take the row locks in the same order
+        missing = sorted(missing)
+        with _intern_conn.cursor() as cursor:
+            cursor.execute("INSERT INTO UserIds (user_id) SELECT unnest(%s::VARCHAR[]) ON CONFLICT DO NOTHING;", (missing,))
+            cursor.execute("SELECT user_id, user_key FROM UserIds WHERE user_id = ANY(%s);", (missing,))
+            _user_keys.update(cursor.fetchall())
+    return _user_keys
 
-def import_review_data(json_file_path, connection):
-    with connection.cursor() as cursor, open(json_file_path, 'r', encoding='utf-8') as file:
-        for line in file:
-            data = json.loads(line)
-            text = cleanStr4SQL(data.get("text", ""))
-
-            sql = f"""
-            INSERT INTO Reviews (
-                review_id, user_id, business_id, stars, date, text, useful, funny, cool
-            ) VALUES (
-                '{data["review_id"]}', '{data["user_id"]}', '{data["business_id"]}',
-                {data["stars"]}, '{data["date"]}', '{text}',
-                {data.get("useful", 0)}, {data.get("funny", 0)}, {data.get("cool", 0)}
-            ) ON CONFLICT (review_id) DO NOTHING;
-            """
-            try:
-                cursor.execute(sql)
-            except Exception as e:
-                print(f"Failed to insert review data: {e}")
-                connection.rollback()
+
+def release_user_keys():
+    # The interning connection otherwise stays open after an in-process import (and keeps a
+    # throwaway benchmark database from being dropped); the cached keys go with it
+    global _intern_conn
+    if _intern_conn is not None:
+        _intern_conn.close()
+        _intern_conn = None
+    _user_keys.clear()
+
+
+def friend_edges(rows):
+    keys = intern_user_ids([user_id for row in rows for user_id in row])
+    return [(keys[user_id], keys[friend_id]) for user_id, friend_id in rows]
+
+
+def copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def stage_rows(cursor, table, rows, offsets):
+    # COPY into a session-local staging table; each row carries the offset of the record it came from
+    spec = TABLES[table]
+    stage = f"stage_{table.lower()}"
+    columns = ', '.join(spec["columns"])
+    if "prepare" in spec:
+        rows = spec["prepare"](cursor, rows)
+    cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {stage} (LIKE {table} INCLUDING DEFAULTS, record_offset BIGINT) ON COMMIT DELETE ROWS;")
+    # Left over from an earlier half of a split batch
+    cursor.execute(f"DELETE FROM {stage};")
+    buffer = io.StringIO()
+    for row, offset in zip(rows, offsets):
+        buffer.write('\t'.join(copy_value(v) for v in row))
+        buffer.write(f'\t{offset}\n')
+    buffer.seek(0)
+    started = time.perf_counter()
+    cursor.copy_expert(f"COPY {stage} ({columns}, record_offset) FROM STDIN", buffer)
+    record_timing(f"copy {table}", time.perf_counter() - started)
+    return stage
+
+
+def find_orphans(cursor, table, stage):
+    # Staged rows whose business or user is not loaded, as (offset, reason)
+    references = TABLES[table].get("references", ())
+    if not references:
+        return []
+    missing = [
+        (column, f"s.{column} IS NOT NULL AND NOT EXISTS (SELECT 1 FROM {parent} p WHERE p.{column} = s.{column})")
+        for column, parent in references
+    ]
+    reasons = ' '.join(f"WHEN {condition} THEN 'unknown {column} ' || s.{column}" for column, condition in missing)
+    conditions = ' OR '.join(f"({condition})" for _, condition in missing)
+    cursor.execute(f"SELECT s.record_offset, CASE {reasons} END FROM {stage} s WHERE {conditions};")
+    return cursor.fetchall()
+
+
+def merge_stage(cursor, table, stage):
+    # Merge the staged rows with the table's upsert rule. Tables with a rollup return what the
+    # merge changed per business, as (business_id, checkins, star sum, reviews, positive) rows
+    spec = TABLES[table]
+    columns = ', '.join(spec["columns"])
+    started = time.perf_counter()
+    insert = f"INSERT INTO {table} ({columns}) " + spec["merge"].format(columns=columns, stage=stage)
+    changes = []
+    if "rollup" in spec:
+        returning, select = spec["rollup"]
+        cursor.execute(f"WITH merged AS ({insert.strip().rstrip(';')} RETURNING {returning}) {select};")
+        changes = cursor.fetchall()
+    else:
+        cursor.execute(insert)
+    for sql in spec.get("after", ()):
+        cursor.execute(sql.format(stage=stage))
+    record_timing(f"merge {table}", time.perf_counter() - started)
+    return changes
+
+
+def ensure_import_tables(connection, partition_reviews=False):
+    create_tables(connection, partition_reviews)
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ImportCheckpoints (
+                file_name VARCHAR(255) PRIMARY KEY,
+                byte_offset BIGINT NOT NULL,
+                completed BOOLEAN NOT NULL DEFAULT FALSE,
+                updated_at TIMESTAMP NOT NULL DEFAULT now()
+            );
+            CREATE TABLE IF NOT EXISTS RejectedRows (
+                id BIGSERIAL PRIMARY KEY,
+                file_name VARCHAR(255) NOT NULL,
+                byte_offset BIGINT NOT NULL,
+                reason TEXT NOT NULL,
+                line TEXT NOT NULL,
+                rejected_at TIMESTAMP NOT NULL DEFAULT now()
+            );
+            CREATE TABLE IF NOT EXISTS ZipcodeStats (
+                zip_code VARCHAR(10) PRIMARY KEY,
+                business_count INT NOT NULL,
+                open_business_count INT NOT NULL,
+                mean_stars NUMERIC(3, 2),
+                total_checkins BIGINT NOT NULL,
+                population INT,
+                avg_income NUMERIC(10, 1)
+            );
+            CREATE TABLE IF NOT EXISTS StaleZipcodes (
+                zip_code VARCHAR(10) PRIMARY KEY
+            );
+            CREATE TABLE IF NOT EXISTS BusinessCategories (
+                business_id VARCHAR(22) NOT NULL REFERENCES Businesses (business_id) ON DELETE CASCADE,
+                category VARCHAR(100) NOT NULL,
+                PRIMARY KEY (business_id, category)
+            );
+            CREATE TABLE IF NOT EXISTS CheckinHours (
+                business_id VARCHAR(22) PRIMARY KEY REFERENCES Businesses (business_id) ON DELETE CASCADE,
+                hours INT[] NOT NULL CHECK (array_dims(hours) = '[1:7][1:24]'),
+                total INT NOT NULL
+            );
+            ALTER TABLE Businesses
+                ADD COLUMN IF NOT EXISTS registration_date DATE,
+                ADD COLUMN IF NOT EXISTS repeat_checkins INT,
+                ADD COLUMN IF NOT EXISTS positive_reviews INT,
+                ADD COLUMN IF NOT EXISTS total_reviews INT,
+                ADD COLUMN IF NOT EXISTS loaded_at TIMESTAMP NOT NULL DEFAULT now();
+            CREATE TABLE IF NOT EXISTS DataVersion (
+                id INT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+                generation BIGINT NOT NULL,
+                updated_at TIMESTAMP NOT NULL DEFAULT now()
+            );
+        """)
+    connection.commit()
+
+
+def bump_data_version(connection):
+    # businessfinder.py drops its query cache when it sees a new generation
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO DataVersion (id, generation) VALUES (1, 1)
+            ON CONFLICT (id) DO UPDATE SET generation = DataVersion.generation + 1, updated_at = now()
+            RETURNING generation;
+        """)
+        generation = cursor.fetchone()[0]
+    connection.commit()
+    return generation
+
+
+def backfill_business_categories(connection):
+    # For databases loaded before BusinessCategories existed
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO BusinessCategories (business_id, category)
+            SELECT DISTINCT business_id, btrim(category)
+            FROM Businesses, unnest(string_to_array(categories, ',')) AS category
+            WHERE btrim(category) <> ''
+            ON CONFLICT DO NOTHING;
+        """)
+        added = cursor.rowcount
+    connection.commit()
+    return added
+
+
+def refresh_zipcode_stats(connection, rebuild=False):
+    # Importers queue every postal code they touch in StaleZipcodes; only those rows are recomputed
+    with connection.cursor() as cursor:
+        if rebuild:
+            cursor.execute("INSERT INTO StaleZipcodes (zip_code) SELECT DISTINCT postal_code FROM Businesses ON CONFLICT DO NOTHING;")
+        cursor.execute("""
+            DELETE FROM ZipcodeStats s USING StaleZipcodes z
+            WHERE s.zip_code = z.zip_code
+            AND NOT EXISTS (SELECT 1 FROM Businesses b WHERE b.postal_code = z.zip_code);
+        """)
+        cursor.execute("""
+            INSERT INTO ZipcodeStats (
+                zip_code, business_count, open_business_count, mean_stars, total_checkins, population, avg_income
+            )
+            SELECT b.postal_code, COUNT(*), COUNT(*) FILTER (WHERE b.is_open), AVG(b.stars),
+                COALESCE(SUM(b.numCheckins), 0), MAX(z.population), MAX(z.avg_income)
+            FROM StaleZipcodes s
+            JOIN Businesses b ON b.postal_code = s.zip_code
+            LEFT JOIN Zipcodes z ON z.zip_code = b.postal_code
+            GROUP BY b.postal_code
+            ON CONFLICT (zip_code) DO UPDATE SET
+                business_count = EXCLUDED.business_count,
+                open_business_count = EXCLUDED.open_business_count,
+                mean_stars = EXCLUDED.mean_stars,
+                total_checkins = EXCLUDED.total_checkins,
+                population = EXCLUDED.population,
+                avg_income = EXCLUDED.avg_income;
+        """)
+        refreshed = cursor.rowcount
+        cursor.execute("TRUNCATE StaleZipcodes;")
+    connection.commit()
+    return refreshed
+
+
+# Per-business totals accumulated while streaming checkins and reviews, written back to
+# Businesses in one bulk UPDATE per file: [checkins, star sum, reviews, positive reviews]
+ROLLUPS = {
+    "checkin": {
+        "reset": ("numCheckins = 0", "numCheckins IS DISTINCT FROM 0"),
+        "rebuild": """
+            UPDATE Businesses b SET numCheckins = s.checkins
+            FROM (
+                SELECT business_id, total AS checkins FROM CheckinHours
+                UNION ALL
+                SELECT business_id, SUM(count) FROM CheckIns c
+                WHERE NOT EXISTS (SELECT 1 FROM CheckinHours h WHERE h.business_id = c.business_id)
+                GROUP BY business_id
+            ) s
+            WHERE b.business_id = s.business_id;
+        """,
+    },
+    "review": {
+        "reset": (
+            "reviewrating = 0, total_reviews = 0, positive_reviews = 0",
+            "reviewrating IS DISTINCT FROM 0 OR total_reviews IS DISTINCT FROM 0 OR positive_reviews IS DISTINCT FROM 0",
+        ),
+        "rebuild": """
+            UPDATE Businesses b SET reviewrating = s.rating, total_reviews = s.reviews, positive_reviews = s.positive
+            FROM (
+                SELECT business_id, AVG(stars) AS rating, COUNT(*) AS reviews,
+                    COUNT(*) FILTER (WHERE stars >= 4) AS positive
+                FROM Reviews GROUP BY business_id
+            ) s
+            WHERE b.business_id = s.business_id;
+        """,
+    },
+}
+
+ROLLUP_MAX_KEYS = 200000
+
+
+def empty_rollup():
+    return [0, 0.0, 0, 0]
+
+
+def new_rollups():
+    return collections.defaultdict(empty_rollup)
+
+
+def add_rollups(rollups, changes):
+    for business_id, *values in changes:
+        totals = rollups[business_id]
+        for i, value in enumerate(values):
+            totals[i] += value
+
+
+def merge_rollups(rollups, other):
+    for business_id, values in other.items():
+        totals = rollups[business_id]
+        for i, value in enumerate(values):
+            totals[i] += value
+
+
+def write_rollups(cursor, rollups):
+    # Additive, so shards and delta runs can each contribute their share of a file
+    if not rollups:
+        return
+    started = time.perf_counter()
+    cursor.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS stage_rollups (
+            business_id VARCHAR(22), checkins BIGINT, star_sum DOUBLE PRECISION, reviews INT, positive INT
+        ) ON COMMIT DELETE ROWS;
+    """)
+    buffer = io.StringIO()
+    for business_id, (checkins, star_sum, reviews, positive) in rollups.items():
+        buffer.write(f"{copy_value(business_id)}\t{checkins}\t{float(star_sum)!r}\t{reviews}\t{positive}\n")
+    buffer.seek(0)
+    cursor.copy_expert("COPY stage_rollups (business_id, checkins, star_sum, reviews, positive) FROM STDIN", buffer)
+    cursor.execute("""
+        UPDATE Businesses b SET
+            numCheckins = COALESCE(b.numCheckins, 0) + s.checkins,
+            reviewrating = CASE WHEN COALESCE(b.total_reviews, 0) + s.reviews > 0
+                THEN (COALESCE(b.reviewrating, 0) * COALESCE(b.total_reviews, 0) + s.star_sum)
+                    / (COALESCE(b.total_reviews, 0) + s.reviews)
+                ELSE b.reviewrating END,
+            total_reviews = COALESCE(b.total_reviews, 0) + s.reviews,
+            positive_reviews = COALESCE(b.positive_reviews, 0) + s.positive
+        FROM stage_rollups s
+        WHERE b.business_id = s.business_id;
+    """)
+    cursor.execute("""
+        INSERT INTO StaleZipcodes (zip_code)
+        SELECT DISTINCT b.postal_code FROM Businesses b JOIN stage_rollups s ON s.business_id = b.business_id
+        WHERE s.checkins <> 0
+        ORDER BY 1
+        ON CONFLICT DO NOTHING;
+    """)
+    record_timing("write rollups", time.perf_counter() - started)
+
+
+def rebuild_rollups(cursor, name):
+    # Recount a file's totals from the loaded rows. Merges only add what they change, so this is
+    # where a file loaded from the top starts, and where a resumed one makes up for the totals
+    # the interrupted run still held in memory
+    columns, changed = ROLLUPS[name]["reset"]
+    cursor.execute(f"UPDATE Businesses SET {columns} WHERE {changed};")
+    cursor.execute(ROLLUPS[name]["rebuild"])
+    if name == "checkin":
+        cursor.execute("INSERT INTO StaleZipcodes (zip_code) SELECT DISTINCT postal_code FROM Businesses ON CONFLICT DO NOTHING;")
+
+
+def get_checkpoint(connection, file_name):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT byte_offset, completed FROM ImportCheckpoints WHERE file_name = %s;", (file_name,))
+        row = cursor.fetchone()
+    return row if row else (0, False)
+
+
+def save_checkpoint(cursor, file_name, offset, completed=False):
+    cursor.execute("""
+        INSERT INTO ImportCheckpoints (file_name, byte_offset, completed) VALUES (%s, %s, %s)
+        ON CONFLICT (file_name) DO UPDATE SET
+            byte_offset = EXCLUDED.byte_offset,
+            completed = EXCLUDED.completed,
+            updated_at = now();
+    """, (file_name, offset, completed))
+
+
+def restart_files(connection, names):
+    # Files about to be loaded from the top: their totals are recounted and their checkpoints
+    # start over in one transaction, so a load interrupted before they finish is never taken
+    # for a finished one
+    with connection.cursor() as cursor:
+        for name in names:
+            if name in ROLLUPS:
+                rebuild_rollups(cursor, name)
+            save_checkpoint(cursor, IMPORTS[name][0], 0)
+    connection.commit()
+
+
+def server_time(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT localtimestamp;")
+        now = cursor.fetchone()[0]
+    connection.commit()
+    return now
+
+
+def queue_business_zipcodes(connection, since=None):
+    # Zipcodes of the businesses loaded since a server time (all of them without one), queued
+    # once per file by the parent; loaders queuing their own held StaleZipcodes rows until their
+    # batch committed, and concurrent ones waited on, or deadlocked with, each other
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO StaleZipcodes (zip_code)
+            SELECT DISTINCT postal_code FROM Businesses WHERE %(since)s::timestamp IS NULL OR loaded_at >= %(since)s
+            ORDER BY 1
+            ON CONFLICT DO NOTHING;
+        """, {"since": since})
+    connection.commit()
+
+
+def start_offset(connection, json_file_path, mode):
+    # full: from the top; resume: finish interrupted files only; delta: pick up appended lines
+    if mode == "full":
+        return 0
+    offset, completed = get_checkpoint(connection, os.path.basename(json_file_path))
+    if mode == "resume" and completed:
+        return None
+    if offset > os.path.getsize(json_file_path):
+        print(f"{json_file_path} is shorter than its checkpoint, starting over")
+        return 0
+    return offset
+
+
+def save_rejects(cursor, file_name, rejects):
+    # PostgreSQL text cannot hold NUL, and a zero-filled tail after a crash is full of them
+    psycopg2.extras.execute_values(cursor, """
+        INSERT INTO RejectedRows (file_name, byte_offset, reason, line) VALUES %s;
+    """, [
+        (file_name, offset, reason.replace('\x00', ''), line.decode('utf-8', 'replace').rstrip('\n').replace('\x00', ''))
+        for offset, reason, line in rejects
+    ])
+
+
+# Splitting a refused batch down to single records takes up to two round trips per record,
+# so a batch gets MERGE_ATTEMPTS tries plus one per MERGE_RECORDS_PER_ATTEMPT records;
+# whatever still fails after that is rejected as it stands
+MERGE_ATTEMPTS = 64
+MERGE_RECORDS_PER_ATTEMPT = 8
+
+
+def merge_records(cursor, records, rollups=None, attempts=None):
+    # Load a list of (offset, line, rows) records. Records pointing at a business or user that
+    # is not loaded are dropped from the staging tables and returned as rejects; a batch the
+    # database refuses anyway is halved until the offending records are isolated. What the
+    # merges changed is added to rollups once their savepoint is released.
+    if attempts is None:
+        attempts = [MERGE_ATTEMPTS + len(records) // MERGE_RECORDS_PER_ATTEMPT]
+    attempts[0] -= 1
+    batch = {}
+    for offset, _, rows in records:
+        for table, row in rows:
+            batch.setdefault(table, ([], []))
+            batch[table][0].append(row)
+            batch[table][1].append(offset)
+    cursor.execute("SAVEPOINT merge_records;")
+    try:
+        stages = {table: stage_rows(cursor, table, rows, offsets) for table, (rows, offsets) in batch.items()}
+        orphans = {}
+        for table, stage in stages.items():
+            for offset, reason in find_orphans(cursor, table, stage):
+                orphans.setdefault(offset, reason)
+        changes = []
+        for table, stage in stages.items():
+            if orphans:
+                cursor.execute(f"DELETE FROM {stage} WHERE record_offset = ANY(%s);", (list(orphans),))
+            changes += merge_stage(cursor, table, stage)
+        cursor.execute("RELEASE SAVEPOINT merge_records;")
+    except psycopg2.Error as e:
+        cursor.execute("ROLLBACK TO SAVEPOINT merge_records; RELEASE SAVEPOINT merge_records;")
+        reason = f"database: {str(e).strip()}"
+        if len(records) == 1:
+            return [(records[0][0], reason, records[0][1])]
+        if attempts[0] <= 0:
+            reason += f" (somewhere in a run of {len(records)} records)"
+            return [(offset, reason, line) for offset, line, _ in records]
+        middle = len(records) // 2
+        return merge_records(cursor, records[:middle], rollups, attempts) + merge_records(cursor, records[middle:], rollups, attempts)
+    if rollups is not None:
+        add_rollups(rollups, changes)
+    return [(offset, orphans[offset], line) for offset, line, _ in records if offset in orphans]
+
+
+def load_batch(connection, file_name, records, rejects, checkpoint=None, rollups=None, flush=False):
+    # What the batch changed is added to rollups once it commits; with flush=True the
+    # totals so far are written in the same transaction and rollups starts over
+    stats = collections.Counter()
+    try:
+        with connection.cursor() as cursor:
+            batch_rollups = new_rollups() if rollups is not None else None
+            failed = merge_records(cursor, records, batch_rollups) if records else []
+            failed_offsets = {offset for offset, _, _ in failed}
+            accepted = [rows for offset, _, rows in records if offset not in failed_offsets]
+            if rollups is not None:
+                if flush:
+                    merge_rollups(batch_rollups, rollups)
+                    write_rollups(cursor, batch_rollups)
+            if rejects or failed:
+                save_rejects(cursor, file_name, rejects + failed)
+            if checkpoint:
+                save_checkpoint(cursor, file_name, checkpoint)
         connection.commit()
+    except Exception as e:
+        print(f"Failed to load batch: {e}")
+        connection.rollback()
+        stats["failed"] += len(records) + len(rejects)
+        return stats
+    if rollups is not None:
+        if flush:
+            rollups.clear()
+        else:
+            merge_rollups(rollups, batch_rollups)
+    stats["accepted"] += len(accepted)
+    stats["rows"] += sum(len(rows) for rows in accepted)
+    stats["rejected"] += len(rejects) + len(failed)
+    return stats
+
+
+def split_file(json_file_path, shards):
+    # Cut the file into byte ranges that each start at the beginning of a line
+    size = os.path.getsize(json_file_path)
+    bounds = [0]
+    with open(json_file_path, 'rb') as file:
+        for i in range(1, shards):
+            file.seek(max(size * i // shards - 1, 0))
+            file.readline()
+            if bounds[-1] < file.tell() < size:
+                bounds.append(file.tell())
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
 
 
-def import_user_data(json_file_path, connection):
-    with connection.cursor() as cursor, open(json_file_path, 'r', encoding='utf-8') as file:
+def read_lines(json_file_path, start=0, end=None, whole_lines=False):
+    # whole_lines: stop before a last line with no newline yet, which a writer may still be appending to
+    with open(json_file_path, 'rb') as file:
+        file.seek(start)
+        offset = start
         for line in file:
+            if end is not None and offset >= end:
+                break
+            if whole_lines and not line.endswith(b'\n'):
+                print(f"{os.path.basename(json_file_path)}: leaving the unfinished line at byte {offset} for the next run")
+                break
+            offset += len(line)
+            if line.strip():
+                yield offset, line
+
+
+def bulk_import(json_file_path, connection, name, batch_size=BATCH_SIZE, start=0, end=None, checkpoint=False, rollups=None,
+                whole_lines=False):
+    # With checkpoint=True every committed batch also records how far into the file it got, and
+    # the first batch that fails stops the file there so --mode resume can pick it up again.
+    # Checkin and review totals go into rollups; when the caller passes none they are
+    # kept here and written to Businesses with the last batch.
+    file_name = os.path.basename(json_file_path)
+    owns_rollups = rollups is None and name in ROLLUPS
+    if owns_rollups:
+        rollups = new_rollups()
+    _, parse, validate = IMPORTS[name]
+    stats = collections.Counter()
+    records = []
+    rejects = []
+    pending = 0
+    offset = start
+    for offset, line in read_lines(json_file_path, start, end, whole_lines):
+        line_start = offset - len(line)
+        try:
             data = json.loads(line)
-            name = cleanStr4SQL(data.get("name", ""))
-            friends = '{' + ','.join([cleanStr4SQL(friend) for friend in data.get("friends", [])]) + '}'
-            elite = '{' + ','.join(map(str, data.get("elite", []))) + '}'
-
-            sql = f"""
-            INSERT INTO Users (
-                user_id, name, review_count, average_stars, useful, funny, cool,
-                friends, elite, fans, compliment_cool, compliment_cute, compliment_funny,
-                compliment_hot, compliment_list, compliment_more, compliment_note, compliment_photos,
-                compliment_plain, compliment_profile, compliment_writer, yelping_since
-            ) VALUES (
-                '{data["user_id"]}', '{name}', {data["review_count"]}, {data["average_stars"]},
-                {data.get("useful", 0)}, {data.get("funny", 0)}, {data.get("cool", 0)},
-                '{friends}', '{elite}', {data["fans"]}, {data.get("compliment_cool", 0)},
-                {data.get("compliment_cute", 0)}, {data.get("compliment_funny", 0)},
-                {data.get("compliment_hot", 0)}, {data.get("compliment_list", 0)},
-                {data.get("compliment_more", 0)}, {data.get("compliment_note", 0)},
-                {data.get("compliment_photos", 0)}, {data.get("compliment_plain", 0)},
-                {data.get("compliment_profile", 0)}, {data.get("compliment_writer", 0)},
-                '{data["yelping_since"]}'
-            ) ON CONFLICT (user_id) DO NOTHING;
-            """
-            try:
-                cursor.execute(sql)
-            except Exception as e:
-                print(f"Failed to insert user data: {e}")
-                connection.rollback()
+            reason = validate(data)
+            if not reason:
+                rows = parse(data)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            reason = f"{type(e).__name__}: {e}"
+        if reason:
+            rejects.append((line_start, reason, line))
+        else:
+            records.append((line_start, line, rows))
+            pending += len(rows)
+        if pending + len(rejects) >= batch_size:
+            flush = rollups is not None and len(rollups) >= ROLLUP_MAX_KEYS
+            stats += load_batch(connection, file_name, records, rejects, offset if checkpoint else None, rollups, flush)
+            records = []
+            rejects = []
+            pending = 0
+            if checkpoint and stats["failed"]:
+                break
+    else:
+        if records or rejects or (owns_rollups and rollups):
+            stats += load_batch(connection, file_name, records, rejects, offset if checkpoint else None, rollups, owns_rollups)
+    if checkpoint and stats["failed"]:
+        print(f"{file_name}: stopped at a failed batch; fix the cause and rerun with --mode resume")
+    elif checkpoint:
+        with connection.cursor() as cursor:
+            save_checkpoint(cursor, file_name, offset, completed=True)
         connection.commit()
+    return stats
+
+
+NUMBER = (int, float)
+
+
+def check_fields(data, fields, optional=False):
+    for key, kind in fields.items():
+        if key not in data:
+            if optional:
+                continue
+            return f"missing {key}"
+        value = data[key]
+        kinds = kind if isinstance(kind, tuple) else (kind,)
+        if not isinstance(value, kinds) or (isinstance(value, bool) and bool not in kinds):
+            return f"{key} has unexpected type {type(value).__name__}"
+    return None
+
+
+# Business, user and review ids are VARCHAR(22) columns
+ID_LENGTH = 22
+
+
+def check_ids(data, *keys):
+    for key in keys:
+        if len(data[key]) > ID_LENGTH:
+            return f"{key} is longer than {ID_LENGTH} characters"
+    return None
+
+
+def check_date(data, key):
+    # Zero-padded only: strptime takes "2015-3-7", but the rows are stored and scored as ISO dates
+    if key in data:
+        try:
+            if re.fullmatch(r"\d{4}-\d{2}-\d{2}", data[key][:10]):
+                datetime.datetime.strptime(data[key][:10], "%Y-%m-%d")
+                return None
+        except (TypeError, ValueError):
+            pass
+        return f"{key} is not a YYYY-MM-DD date"
+    return None
+
+
+def validate_business(data):
+    reason = check_fields(data, {
+        "business_id": str, "name": str, "address": str, "city": str, "state": str, "postal_code": str,
+        "latitude": NUMBER, "longitude": NUMBER, "stars": NUMBER, "review_count": int, "is_open": (int, bool),
+    }) or check_fields(data, {
+        "neighborhood": str, "categories": (str, list, type(None)), "attributes": (dict, type(None)), "hours": (dict, type(None)),
+        "repeat_checkins": NUMBER, "positive_reviews": NUMBER, "total_checkins": NUMBER, "total_reviews": NUMBER,
+    }, optional=True) or check_ids(data, "business_id") or check_date(data, "registration_date")
+    if reason:
+        return reason
+    if not -90 <= data["latitude"] <= 90 or not -180 <= data["longitude"] <= 180:
+        return "latitude/longitude out of range"
+    return None
+
+
+def validate_checkin(data):
+    reason = check_fields(data, {"business_id": str, "time": dict}) or check_ids(data, "business_id")
+    if reason:
+        return reason
+    for times in data["time"].values():
+        if not isinstance(times, dict) or not all(isinstance(count, int) for count in times.values()):
+            return "time must map day -> hour -> count"
+    return None
+
+
+def validate_review(data):
+    reason = check_fields(data, {
+        "review_id": str, "user_id": str, "business_id": str, "stars": NUMBER, "date": str,
+    }) or check_fields(data, {
+        "text": str, "useful": int, "funny": int, "cool": int,
+    }, optional=True) or check_ids(data, "review_id", "user_id", "business_id") or check_date(data, "date")
+    if reason:
+        return reason
+    # Reviews.stars is an INT column: 4.0 is written as 4 by review_rows, 3.5 has nowhere to go
+    if isinstance(data["stars"], float) and not data["stars"].is_integer():
+        return "stars is not a whole number"
+    return None
+
+
+def validate_user(data):
+    return check_fields(data, {
+        "user_id": str, "review_count": int, "average_stars": NUMBER, "fans": int, "yelping_since": str,
+    }) or check_fields(data, {
+        "name": str, "friends": list, "elite": list, "useful": int, "funny": int, "cool": int,
+    }, optional=True) or check_ids(data, "user_id") or check_date(data, "yelping_since") or check_friends(data)
+
+
+def check_friends(data):
+    if not all(isinstance(friend, str) and 0 < len(friend) <= ID_LENGTH for friend in data.get("friends", [])):
+        return "friends has an entry that is not a user id"
+    return None
+
+
+def business_rows(data):
+    # business_age and success_score are filled in per batch by score_business_rows
+    categories = data.get("categories") or ""
+    if isinstance(categories, str):
+        categories = categories.split(',')
+    categories = list(dict.fromkeys(c.strip() for c in categories if c.strip()))
+
+    return [("Businesses", (
+        data["business_id"], data["name"], data.get("neighborhood", ""), data["address"],
+        data["city"], data["state"], data["postal_code"], data["latitude"], data["longitude"],
+        data["stars"], data["review_count"], bool(data["is_open"]),
+        json.dumps(data.get("attributes", {})), ', '.join(categories), json.dumps(data.get("hours", {})),
+        0, 0.0, None, None, data.get("registration_date", "2000-01-01")[:10],
+        data.get("repeat_checkins", 0), 0, 0
+    ))] + [("BusinessCategories", (data["business_id"], category)) for category in categories]
+
+
+def score_business_rows(rows):
+    columns = TABLES["Businesses"]["columns"]
+    position = {name: columns.index(name) for name in (
+        "numCheckins", "business_age", "success_score", "registration_date",
+        "repeat_checkins", "positive_reviews", "total_reviews",
+    )}
+    values = list(zip(*rows))
+    ages, scores = score_businesses(
+        values[position["registration_date"]], values[position["repeat_checkins"]],
+        values[position["positive_reviews"]], values[position["numCheckins"]], values[position["total_reviews"]],
+    )
+    age_at = position["business_age"]
+    return [
+        row[:age_at] + (int(age), float(score)) + row[age_at + 2:]
+        for row, age, score in zip(rows, ages, scores)
+    ]
+
+
+def recompute_scores(connection, chunk_size=BATCH_SIZE):
+    # Re-score every stored business from its saved inputs; no JSON is read
+    updated = 0
+    with connection.cursor(name="score_inputs") as source, connection.cursor() as cursor:
+        cursor.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS stage_scores (
+                business_id VARCHAR(22), business_age INT, success_score DOUBLE PRECISION
+            ) ON COMMIT DROP;
+        """)
+        source.itersize = chunk_size
+        source.execute("""
+            SELECT business_id, COALESCE(registration_date, DATE '2000-01-01'), COALESCE(repeat_checkins, 0),
+                COALESCE(positive_reviews, 0), COALESCE(numCheckins, 1), COALESCE(total_reviews, 1)
+            FROM Businesses;
+        """)
+        while True:
+            rows = source.fetchmany(chunk_size)
+            if not rows:
+                break
+            business_ids, *inputs = zip(*rows)
+            ages, scores = score_businesses(*inputs)
+            buffer = io.StringIO()
+            for business_id, age, score in zip(business_ids, ages, scores):
+                buffer.write(f"{copy_value(business_id)}\t{int(age)}\t{float(score)!r}\n")
+            buffer.seek(0)
+            cursor.copy_expert("COPY stage_scores (business_id, business_age, success_score) FROM STDIN", buffer)
+            updated += len(rows)
+        cursor.execute("""
+            UPDATE Businesses b SET business_age = s.business_age, success_score = s.success_score
+            FROM stage_scores s
+            WHERE b.business_id = s.business_id;
+        """)
+    connection.commit()
+    return updated
+
+
+def checkin_rows(data):
+    business_id = data['business_id']
+    return [
+        ("CheckIns", (business_id, day, hour, count))
+        for day, times in data['time'].items()
+        for hour, count in times.items()
+    ]
+
+
+def checkin_grid(times):
+    # day -> "H:MM" -> count folded into a 7x24 array, Monday first
+    grid = np.zeros((7, 24), dtype=np.int32)
+    for day, hours in times.items():
+        if day not in DAYS:
+            raise ValueError(f"unknown day: {day}")
+        row = DAYS.index(day)
+        for hour, count in hours.items():
+            column = int(hour.split(':')[0])
+            if not 0 <= column < 24:
+                raise ValueError(f"hour out of range: {hour}")
+            grid[row, column] += count
+    return grid
+
+
+def checkin_hour_rows(data):
+    # One CheckinHours row per business instead of up to 168 CheckIns rows
+    grid = checkin_grid(data['time'])
+    hours = '{' + ','.join('{' + ','.join(map(str, row)) + '}' for row in grid.tolist()) + '}'
+    return [("CheckinHours", (data['business_id'], hours, int(grid.sum())))]
+
+
+def review_rows(data):
+    return [("Reviews", (
+        data["review_id"], data["user_id"], data["business_id"], int(data["stars"]), data["date"],
+        data.get("text", ""), data.get("useful", 0), data.get("funny", 0), data.get("cool", 0)
+    ))]
+
+
+def user_rows(data):
+    return [("Users", (
+        data["user_id"], data.get("name", ""), data["review_count"], data["average_stars"],
+        data.get("useful", 0), data.get("funny", 0), data.get("cool", 0),
+        '{' + ','.join(map(str, data.get("elite", []))) + '}',
+        data["fans"], data.get("compliment_cool", 0), data.get("compliment_cute", 0),
+        data.get("compliment_funny", 0), data.get("compliment_hot", 0), data.get("compliment_list", 0),
+        data.get("compliment_more", 0), data.get("compliment_note", 0), data.get("compliment_photos", 0),
+        data.get("compliment_plain", 0), data.get("compliment_profile", 0), data.get("compliment_writer", 0),
+        data["yelping_since"]
+    ))] + [("Friends", (data["user_id"], friend)) for friend in dict.fromkeys(data.get("friends", []))]
+
+
+def import_business_data(json_file_path, connection, batch_size=BATCH_SIZE):
+    return bulk_import(json_file_path, connection, "business", batch_size)
+
+
+def import_checkin_data(json_file_path, connection, batch_size=BATCH_SIZE):
+    return bulk_import(json_file_path, connection, "checkin", batch_size)
+
+
+def import_review_data(json_file_path, connection, batch_size=BATCH_SIZE):
+    return bulk_import(json_file_path, connection, "review", batch_size)
+
+
+def import_user_data(json_file_path, connection, batch_size=BATCH_SIZE):
+    return bulk_import(json_file_path, connection, "user", batch_size)
+
+
+IMPORTS = {
+    "business": ("yelp_business.json", business_rows, validate_business),
+    "checkin": ("yelp_checkin.json", checkin_hour_rows, validate_checkin),
+    "user": ("yelp_user.json", user_rows, validate_user),
+    "review": ("yelp_review.json", review_rows, validate_review),
+}
+
+# Tables inside a stage have no foreign keys between them and load concurrently
+LOAD_STAGES = [("business", "user"), ("checkin", "review")]
+
+SHARD_BYTES = 16 * 1024 * 1024
+
+CHECKIN_STORAGE = {"compact": checkin_hour_rows, "rows": checkin_rows}
+
+_worker_conn = None
+
+
+def use_checkin_storage(storage):
+    # compact: a 7x24 int[] per business in CheckinHours; rows: one CheckIns row per day/hour
+    file_name, _, validate = IMPORTS["checkin"]
+    IMPORTS["checkin"] = (file_name, CHECKIN_STORAGE[storage], validate)
+
+
+def init_worker(checkin_storage="compact"):
+    global _worker_conn
+    use_checkin_storage(checkin_storage)
+    _worker_conn = connect_db()
+
+
+def peak_rss_kb():
+    # ru_maxrss is KB on Linux and bytes on macOS
+    scale = 1024 if sys.platform == "darwin" else 1
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale
+
+
+def import_shard(name, json_file_path, start, end, batch_size):
+    # Rollups go back to the parent, which writes each file's totals once all its shards are in;
+    # the worker's own peak RSS comes back too, since the parent cannot see it while the pool lives
+    rollups = new_rollups() if name in ROLLUPS else None
+    stats = bulk_import(json_file_path, _worker_conn, name, batch_size, start, end, rollups=rollups)
+    return name, stats, rollups, peak_rss_kb()
+
+
+def report(name, stats, seconds):
+    record_timing(f"import {name}", seconds)
+    rate = stats["rows"] / seconds if seconds > 0 else 0
+    print(f"{name}: {stats['rows']} rows in {seconds:.1f}s ({rate:,.0f} rows/sec), "
+          f"{stats['accepted']} records accepted, {stats['rejected']} rejected, {stats['failed']} failed")
+
+
+def summarize(summary):
+    print("Run summary:")
+    for name, stats in summary.items():
+        print(f"  {name}: {stats['accepted']} accepted, {stats['rejected']} rejected "
+              f"(see RejectedRows), {stats['failed']} lost to failed batches")
+
+
+def sequential_import(data_dir, connection, batch_size=BATCH_SIZE, mode="full"):
+    summary = {}
+    try:
+        for stage in LOAD_STAGES:
+            for name in stage:
+                json_file_path = os.path.join(data_dir, IMPORTS[name][0])
+                start = start_offset(connection, json_file_path, mode)
+                if start is None:
+                    print(f"{name}: already complete, skipping")
+                    continue
+                if start:
+                    print(f"{name}: continuing from byte {start}")
+                resumed = start and not get_checkpoint(connection, os.path.basename(json_file_path))[1]
+                if not start:
+                    restart_files(connection, [name])
+                # Businesses an interrupted run loaded are not told apart from older ones
+                since = None if resumed else server_time(connection)
+                started = time.perf_counter()
+                summary[name] = bulk_import(json_file_path, connection, name, batch_size, start=start, checkpoint=True,
+                                            whole_lines=mode != "full")
+                if name == "business":
+                    queue_business_zipcodes(connection, since)
+                if summary[name]["failed"]:
+                    # Later files build on this one; resume finishes it first and recounts its totals
+                    report(name, summary[name], time.perf_counter() - started)
+                    return summary
+                if name in ROLLUPS and resumed:
+                    with connection.cursor() as cursor:
+                        rebuild_rollups(cursor, name)
+                    connection.commit()
+                report(name, summary[name], time.perf_counter() - started)
+        return summary
+    finally:
+        release_user_keys()
+
+
+def parallel_import(data_dir, connection, workers, batch_size=BATCH_SIZE, checkin_storage="compact"):
+    summary = {}
+    # forkserver: the census download may be running on a thread of this process
+    context = multiprocessing.get_context("forkserver")
+    with concurrent.futures.ProcessPoolExecutor(workers, mp_context=context, initializer=init_worker,
+                                                initargs=(checkin_storage,)) as pool:
+        for stage in LOAD_STAGES:
+            started = time.perf_counter()
+            futures = []
+            remaining = dict.fromkeys(stage, 0)
+            rollups = {name: new_rollups() for name in stage if name in ROLLUPS}
+            restart_files(connection, stage)
+            since = server_time(connection)
+            for name in stage:
+                json_file_path = os.path.join(data_dir, IMPORTS[name][0])
+                # Several shards per worker so a slow range does not leave the others idle
+                shards = max(1, min(workers * 4, os.path.getsize(json_file_path) // SHARD_BYTES))
+                for start, end in split_file(json_file_path, shards):
+                    futures.append(pool.submit(import_shard, name, json_file_path, start, end, batch_size))
+                    remaining[name] += 1
+                summary[name] = collections.Counter()
+
+            for future in concurrent.futures.as_completed(futures):
+                name, stats, shard_rollups, worker_rss = future.result()
+                summary[name] += stats
+                summary[name]["worker_peak_rss_kb"] = max(summary[name]["worker_peak_rss_kb"], worker_rss)
+                if shard_rollups:
+                    merge_rollups(rollups[name], shard_rollups)
+                remaining[name] -= 1
+                if not remaining[name]:
+                    # Shards finish out of order, so only a fully loaded file gets a checkpoint; one with
+                    # a failed batch keeps the (0, not completed) that restart_files gave it
+                    file_name = IMPORTS[name][0]
+                    with connection.cursor() as cursor:
+                        if name in rollups:
+                            write_rollups(cursor, rollups.pop(name))
+                        if not summary[name]["failed"]:
+                            save_checkpoint(cursor, file_name, os.path.getsize(os.path.join(data_dir, file_name)), completed=True)
+                    connection.commit()
+                    if name == "business":
+                        queue_business_zipcodes(connection, since)
+                    report(name, summary[name], time.perf_counter() - started)
+    return summary
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load the Yelp dataset into PostgreSQL")
+    parser.add_argument("--data-dir", default="yelpDB", help="directory holding the yelp_*.json files")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="rows per COPY batch")
+    parser.add_argument("--workers", type=int, default=1, help="parser/loader processes (1 loads sequentially)")
+    parser.add_argument("--mode", choices=("full", "resume", "delta"), default="full",
+                        help="full reload, resume an interrupted load, or load only lines appended since the last run")
+    parser.add_argument("--rebuild-stats", action="store_true", help="recompute ZipcodeStats for every zipcode")
+    parser.add_argument("--backfill-categories", action="store_true",
+                        help="fill BusinessCategories from the categories column of already loaded businesses")
+    parser.add_argument("--recompute-scores", action="store_true",
+                        help="only recompute business_age/success_score for every stored business, then exit")
+    parser.add_argument("--checkin-storage", choices=tuple(CHECKIN_STORAGE), default="compact",
+                        help="store checkins as one 7x24 array per business (compact) or one row per day/hour (rows)")
+    parser.add_argument("--partition-reviews", action="store_true",
+                        help="create Reviews range-partitioned by year of date (new databases only)")
+    parser.add_argument("--keep-indexes", action="store_true",
+                        help="leave the GUI's secondary indexes in place during a full load instead of rebuilding them")
+    parser.add_argument("--index-workers", type=int, default=INDEX_WORKERS, help="connections used to build indexes")
+    parser.add_argument("--census-offline", action="store_true",
+                        help="use cached census data (or --census-snapshot) and never touch the network")
+    parser.add_argument("--census-snapshot", help="census snapshot file written by census.py, used when offline "
+                                                  "or when a download fails")
+    parser.add_argument("--export-snapshot", metavar="FILE",
+                        help="afterwards write the SQLite snapshot businessfinder.py can browse without the server")
+    args = parser.parse_args()
+    if args.workers > 1 and args.mode != "full":
+        parser.error("--mode resume/delta commits checkpoints in file order and needs --workers 1")
+
     conn = connect_db()
-    if conn:
-        fetch_and_process_census_data()
-        import_business_data('yelpDB/yelp_business.json', conn)
-        import_checkin_data('yelpDB/yelp_checkin.json', conn)
-        import_user_data('yelpDB/yelp_user.json', conn)
-        import_review_data('yelpDB/yelp_review.json', conn)
+    if conn and args.recompute_scores:
+        ensure_import_tables(conn)
+        started = time.perf_counter()
+        print(f"Recomputed scores for {recompute_scores(conn, args.batch_size)} businesses "
+              f"in {time.perf_counter() - started:.1f}s")
+        print(f"Data version is now {bump_data_version(conn)}")
+        conn.close()
+    elif conn:
+        ensure_import_tables(conn, args.partition_reviews)
+        # The census download runs alongside the load; Zipcodes is only needed for ZipcodeStats
+        census_pool = concurrent.futures.ThreadPoolExecutor(1)
+        census = census_pool.submit(load_census, args.census_offline, args.census_snapshot)
+        # A full load runs against index-free tables; resume/delta loads are small enough to keep them
+        if args.mode == "full" and not args.keep_indexes:
+            drop_secondary_indexes(conn)
+        use_checkin_storage(args.checkin_storage)
+        if args.workers > 1:
+            summary = parallel_import(args.data_dir, conn, args.workers, args.batch_size, args.checkin_storage)
+        else:
+            summary = sequential_import(args.data_dir, conn, args.batch_size, args.mode)
+        summarize(summary)
+        print(f"Updated {insert_data_into_db(conn, combine_census_data(census.result()))} zipcodes from census data")
+        census_pool.shutdown()
+        started = time.perf_counter()
+        build_secondary_indexes(conn, args.index_workers)
+        print(f"Built secondary indexes in {time.perf_counter() - started:.1f}s")
+        if args.backfill_categories:
+            print(f"Backfilled {backfill_business_categories(conn)} business categories")
+        # Scores were computed while businesses loaded, before the checkin and review totals were in
+        print(f"Rescored {recompute_scores(conn, args.batch_size)} businesses")
+        print(f"Refreshed statistics for {refresh_zipcode_stats(conn, args.rebuild_stats)} zipcodes")
+        print(f"Data version is now {bump_data_version(conn)}")
+        if args.export_snapshot:
+            counts = export_snapshot(conn, args.export_snapshot)
+            print(f"Exported {counts['businesses']} businesses to {args.export_snapshot}")
+        for name, timing in statement_timings().items():
+            print(f"  {name}: {timing['calls']} calls, {timing['total']:.2f}s total, {timing['max']:.3f}s max")
         conn.close()
     else:
-        print("Failed to connect to the database.")
\ No newline at end of file
+        print("Failed to connect to the database.")
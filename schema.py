@@ -0,0 +1,177 @@
+import os
+import time
+import datetime
+import concurrent.futures
+from db import connect_db, record_timing
+
+# Base tables populate.py loads into; the bookkeeping tables are in populate.ensure_import_tables
+TABLES = """
+    CREATE TABLE IF NOT EXISTS Zipcodes (
+        zip_code VARCHAR(5) PRIMARY KEY,
+        population INT,
+        avg_income NUMERIC(10, 1)
+    );
+    CREATE TABLE IF NOT EXISTS Businesses (
+        business_id VARCHAR(22) PRIMARY KEY,
+        name TEXT,
+        neighborhood TEXT,
+        address TEXT,
+        city TEXT,
+        state TEXT,
+        postal_code TEXT,
+        latitude DOUBLE PRECISION,
+        longitude DOUBLE PRECISION,
+        stars NUMERIC(2, 1),
+        review_count INT,
+        is_open BOOLEAN,
+        attributes TEXT,
+        categories TEXT,
+        hours TEXT,
+        numCheckins INT,
+        reviewrating DOUBLE PRECISION,
+        business_age INT,
+        success_score DOUBLE PRECISION,
+        registration_date DATE,
+        repeat_checkins INT,
+        positive_reviews INT,
+        total_reviews INT,
+        loaded_at TIMESTAMP NOT NULL DEFAULT now()
+    );
+    -- Friendships are in Friends; databases created before it keep an unused friends TEXT[] column
+    CREATE TABLE IF NOT EXISTS Users (
+        user_id VARCHAR(22) PRIMARY KEY,
+        name TEXT,
+        review_count INT,
+        average_stars NUMERIC(3, 2),
+        useful INT,
+        funny INT,
+        cool INT,
+        elite INT[],
+        fans INT,
+        compliment_cool INT,
+        compliment_cute INT,
+        compliment_funny INT,
+        compliment_hot INT,
+        compliment_list INT,
+        compliment_more INT,
+        compliment_note INT,
+        compliment_photos INT,
+        compliment_plain INT,
+        compliment_profile INT,
+        compliment_writer INT,
+        yelping_since DATE
+    );
+    -- Integer surrogates for user ids, so each friendship edge is two INTs instead of two VARCHAR(22)s
+    CREATE TABLE IF NOT EXISTS UserIds (
+        user_key SERIAL PRIMARY KEY,
+        user_id VARCHAR(22) NOT NULL UNIQUE
+    );
+    CREATE TABLE IF NOT EXISTS Friends (
+        user_key INT NOT NULL,
+        friend_key INT NOT NULL,
+        PRIMARY KEY (user_key, friend_key)
+    );
+    CREATE TABLE IF NOT EXISTS CheckIns (
+        business_id VARCHAR(22) REFERENCES Businesses (business_id),
+        day VARCHAR(10),
+        hour VARCHAR(5),
+        count INT,
+        PRIMARY KEY (business_id, day, hour)
+    );
+"""
+
+# A partitioned table's primary key has to include the partition column
+REVIEWS = """
+    CREATE TABLE IF NOT EXISTS Reviews (
+        review_id VARCHAR(22) NOT NULL,
+        user_id VARCHAR(22) REFERENCES Users (user_id),
+        business_id VARCHAR(22) REFERENCES Businesses (business_id),
+        stars INT,
+        date DATE NOT NULL,
+        text TEXT,
+        useful INT,
+        funny INT,
+        cool INT,
+        text_search TSVECTOR GENERATED ALWAYS AS ({text_search}) STORED,
+        PRIMARY KEY {key}
+    ) {partitioning};
+"""
+
+REVIEW_PARTITION_FIRST_YEAR = 2004
+# Computed by the server as rows are merged in; businessfinder.search_reviews uses the same configuration
+TEXT_SEARCH = "to_tsvector('english', coalesce(text, ''))"
+
+# Indexes only the GUI needs; bulk loads drop them and build them again afterwards
+SECONDARY_INDEXES = {
+    "businesses_state_city_idx": "Businesses (state, city)",
+    "businesses_postal_code_idx": "Businesses (postal_code)",
+    "reviews_business_id_idx": "Reviews (business_id)",
+    "reviews_user_id_idx": "Reviews (user_id)",
+    "reviews_text_search_idx": "Reviews USING gin (text_search)",
+    "businesscategories_category_idx": "BusinessCategories (category, business_id)",
+}
+
+INDEX_WORKERS = int(os.environ.get("INDEX_WORKERS", 4))
+MAINTENANCE_WORK_MEM = os.environ.get("INDEX_MAINTENANCE_WORK_MEM", "256MB")
+
+
+def review_partitions(first_year, last_year):
+    # One partition per year plus a default one for dates outside the range
+    statements = [
+        f"CREATE TABLE IF NOT EXISTS reviews_{year} PARTITION OF Reviews "
+        f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01');"
+        for year in range(first_year, last_year + 1)
+    ]
+    statements.append("CREATE TABLE IF NOT EXISTS reviews_default PARTITION OF Reviews DEFAULT;")
+    return "\n".join(statements)
+
+
+def create_tables(connection, partition_reviews=False):
+    # Existing tables are left as they are, so partition_reviews only matters for a new database
+    with connection.cursor() as cursor:
+        cursor.execute(TABLES)
+        if partition_reviews:
+            cursor.execute(REVIEWS.format(key="(review_id, date)", partitioning="PARTITION BY RANGE (date)", text_search=TEXT_SEARCH))
+            cursor.execute(review_partitions(REVIEW_PARTITION_FIRST_YEAR, datetime.date.today().year + 1))
+        else:
+            cursor.execute(REVIEWS.format(key="(review_id)", partitioning="", text_search=TEXT_SEARCH))
+        # Databases created before review search existed
+        cursor.execute(f"ALTER TABLE Reviews ADD COLUMN IF NOT EXISTS text_search TSVECTOR GENERATED ALWAYS AS ({TEXT_SEARCH}) STORED;")
+    connection.commit()
+
+
+def drop_secondary_indexes(connection):
+    with connection.cursor() as cursor:
+        for name in SECONDARY_INDEXES:
+            cursor.execute(f"DROP INDEX IF EXISTS {name};")
+    connection.commit()
+
+
+def build_index(name, maintenance_workers):
+    conn = connect_db()
+    if conn is None:
+        return name, 0.0
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute("SET max_parallel_maintenance_workers = %s;", (maintenance_workers,))
+            cursor.execute("SET maintenance_work_mem = %s;", (MAINTENANCE_WORK_MEM,))
+            started = time.perf_counter()
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {SECONDARY_INDEXES[name]};")
+            seconds = time.perf_counter() - started
+        record_timing(f"index {name}", seconds)
+        return name, seconds
+    finally:
+        conn.close()
+
+
+def build_secondary_indexes(connection, workers=INDEX_WORKERS):
+    # Each index is built on its own connection, and each of those builds may use parallel
+    # maintenance workers; indexes that already exist are skipped
+    maintenance_workers = max(1, workers // len(SECONDARY_INDEXES))
+    with concurrent.futures.ThreadPoolExecutor(max(1, min(workers, len(SECONDARY_INDEXES)))) as pool:
+        built = dict(pool.map(lambda name: build_index(name, maintenance_workers), SECONDARY_INDEXES))
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE Businesses, BusinessCategories, Reviews, UserIds, Friends;")
+    connection.commit()
+    return built
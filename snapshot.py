@@ -0,0 +1,313 @@
+import os
+import sys
+import time
+import sqlite3
+import datetime
+import itertools
+import contextlib
+import threading
+from db import connect_db, record_timing, get_data_version as server_data_version
+
+# Read-only SQLite copy of the tables businessfinder.py browses, so the GUI can run without
+# a database server. The query functions below mirror businessfinder's: same names, same rows.
+
+SCHEMA = """
+    CREATE TABLE businesses (
+        business_id TEXT PRIMARY KEY,
+        name TEXT,
+        city TEXT,
+        state TEXT,
+        postal_code TEXT,
+        stars REAL,
+        review_count INTEGER,
+        reviewrating REAL,
+        numCheckins INTEGER,
+        is_open INTEGER,
+        hours TEXT
+    );
+    -- Keyed by zipcode first: every GUI lookup by category is within one zipcode
+    CREATE TABLE businesscategories (
+        postal_code TEXT NOT NULL,
+        category TEXT NOT NULL,
+        business_id TEXT NOT NULL,
+        PRIMARY KEY (postal_code, category, business_id)
+    ) WITHOUT ROWID;
+    CREATE TABLE zipcodecategories (
+        postal_code TEXT NOT NULL,
+        category TEXT NOT NULL,
+        business_count INTEGER NOT NULL,
+        PRIMARY KEY (postal_code, category)
+    ) WITHOUT ROWID;
+    CREATE TABLE zipcodestats (
+        zip_code TEXT PRIMARY KEY,
+        business_count INTEGER,
+        open_business_count INTEGER,
+        mean_stars REAL,
+        total_checkins INTEGER,
+        population INTEGER,
+        avg_income REAL
+    ) WITHOUT ROWID;
+    CREATE TABLE snapshotinfo (
+        generation INTEGER,
+        exported_at TEXT
+    );
+"""
+
+# Built once the rows are in, like populate.py does for the server's secondary indexes
+INDEXES = """
+    CREATE INDEX businesses_state_city_idx ON businesses (state, city, name);
+    CREATE INDEX businesses_location_idx ON businesses (state, city, postal_code);
+"""
+
+# NUMERIC columns are cast on the server; sqlite3 cannot bind Decimal
+EXPORTS = {
+    "businesses": """
+        SELECT business_id, name, city, state, postal_code, stars::float8, review_count, reviewrating,
+            numCheckins, is_open, hours
+        FROM businesses
+    """,
+    "businesscategories": """
+        SELECT coalesce(b.postal_code, ''), c.category, c.business_id
+        FROM businesscategories c JOIN businesses b ON b.business_id = c.business_id
+    """,
+    "zipcodecategories": """
+        SELECT coalesce(b.postal_code, ''), c.category, COUNT(*)
+        FROM businesscategories c JOIN businesses b ON b.business_id = c.business_id
+        GROUP BY 1, 2
+    """,
+    "zipcodestats": """
+        SELECT zip_code, business_count, open_business_count, mean_stars::float8, total_checkins,
+            population, avg_income::float8
+        FROM zipcodestats
+    """,
+}
+
+EXPORT_BATCH_SIZE = 10000
+MMAP_SIZE = 1 << 30
+
+
+def export_snapshot(conn, path, batch_size=EXPORT_BATCH_SIZE):
+    # Rows stream from a server-side cursor in batches; the file is written next to path and
+    # renamed over it at the end, so a running GUI never sees a half-written snapshot
+    generation = server_data_version(conn)
+    temporary = path + ".tmp"
+    if os.path.exists(temporary):
+        os.remove(temporary)
+    counts = {}
+    target = sqlite3.connect(temporary)
+    try:
+        target.execute("PRAGMA journal_mode = OFF;")
+        target.execute("PRAGMA synchronous = OFF;")
+        target.executescript(SCHEMA)
+        for table, sql in EXPORTS.items():
+            started = time.perf_counter()
+            counts[table] = 0
+            with conn.cursor(name=f"export_{table}") as cur:
+                cur.itersize = batch_size
+                cur.execute(sql)
+                while True:
+                    rows = cur.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    placeholders = ', '.join('?' * len(rows[0]))
+                    target.executemany(f"INSERT INTO {table} VALUES ({placeholders})", rows)
+                    counts[table] += len(rows)
+            record_timing(f"export {table}", time.perf_counter() - started)
+        target.execute("INSERT INTO snapshotinfo VALUES (?, ?);", (generation, datetime.datetime.now().isoformat()))
+        target.commit()
+        target.executescript(INDEXES)
+        target.execute("ANALYZE;")
+        target.commit()
+    finally:
+        target.close()
+        conn.rollback()
+    os.replace(temporary, path)
+    return counts
+
+
+class SnapshotConnection(sqlite3.Connection):
+    # Quacks enough like a psycopg2 connection for QueryWorker and QueryCache
+    closed = False
+
+    def cancel(self):
+        self.interrupt()
+
+
+def open_snapshot(path):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No snapshot at {path}; export one with: python snapshot.py {path}")
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False, factory=SnapshotConnection)
+    conn.execute("PRAGMA query_only = ON;")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE};")
+    return conn
+
+
+_local = threading.local()
+
+
+@contextlib.contextmanager
+def snapshot_connection(path):
+    # Each query thread keeps its own read-only connection to the file
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    if path not in connections:
+        connections[path] = open_snapshot(path)
+    yield connections[path]
+
+
+def query(conn, name, sql, params=()):
+    started = time.perf_counter()
+    rows = conn.execute(sql, params).fetchall()
+    record_timing(name, time.perf_counter() - started)
+    return rows
+
+
+def get_data_version(conn):
+    try:
+        row = conn.execute("SELECT generation FROM snapshotinfo;").fetchone()
+    except sqlite3.Error:
+        return None
+    return row[0] if row else None
+
+
+def get_states(conn):
+    return query(conn, "get_states", "SELECT DISTINCT state FROM businesses ORDER BY state;")
+
+
+def get_cities(conn, selected_state):
+    return query(conn, "get_cities", "SELECT DISTINCT city FROM businesses WHERE state = ? ORDER BY city;", (selected_state,))
+
+
+def get_locations(conn):
+    rows = query(conn, "get_locations", """
+        SELECT DISTINCT state, city, postal_code
+        FROM businesses
+        WHERE state IS NOT NULL AND city IS NOT NULL
+        ORDER BY state, city, postal_code;
+    """)
+    return [
+        (state, city, [zipcode for _, _, zipcode in group])
+        for (state, city), group in itertools.groupby(rows, key=lambda row: row[:2])
+    ]
+
+
+# Same columns and keyset paging as businessfinder.BUSINESSES_SQL
+BUSINESSES_SQL = """
+    SELECT name, city, state, stars, review_count, reviewrating, numCheckins,
+    is_open, hours, business_id
+    FROM businesses b
+    WHERE city = ? AND state = ? {after}
+    ORDER BY b.name, b.business_id
+    LIMIT ?
+"""
+
+BUSINESSES_BY_CATEGORY_SQL = """
+    SELECT b.name, b.city, b.state, b.stars, b.review_count, b.reviewrating, b.numCheckins,
+    b.is_open, b.hours, b.business_id
+    FROM businesscategories c JOIN businesses b ON b.business_id = c.business_id
+    WHERE c.postal_code = ? AND c.category = ? {after}
+    ORDER BY b.name, b.business_id
+    LIMIT ?
+"""
+
+AFTER_SQL = "AND (b.name, b.business_id) > (?, ?)"
+
+
+def business_page(conn, name, sql, params, after, limit):
+    # SQLite reads LIMIT -1 as no limit
+    limit = -1 if limit is None else limit
+    if after is None:
+        return query(conn, name, sql.format(after=""), params + (limit,))
+    return query(conn, f"{name}_after", sql.format(after=AFTER_SQL), params + tuple(after) + (limit,))
+
+
+def get_businesses(conn, selected_city, selected_state, after=None, limit=None):
+    return business_page(conn, "get_businesses", BUSINESSES_SQL, (selected_city, selected_state), after, limit)
+
+
+def get_zipcodes(conn, selected_city, selected_state):
+    return query(conn, "get_zipcodes", """
+        SELECT DISTINCT postal_code FROM businesses WHERE city = ? AND state = ? ORDER BY postal_code;
+    """, (selected_city, selected_state))
+
+
+def get_categories(conn, selected_zipcode):
+    return query(conn, "get_categories", """
+        SELECT category FROM zipcodecategories WHERE postal_code = ? ORDER BY category;
+    """, (selected_zipcode,))
+
+
+def get_zipcode_stats(conn, selected_zipcode):
+    rows = query(conn, "get_zipcode_stats", """
+        SELECT business_count, population, avg_income, open_business_count, mean_stars, total_checkins
+        FROM zipcodestats
+        WHERE zip_code = ?;
+    """, (selected_zipcode,))
+    return rows[0] if rows else None
+
+
+def get_businesses_by_category(conn, selected_zipcode, selected_category, after=None, limit=None):
+    return business_page(
+        conn, "get_businesses_by_category", BUSINESSES_BY_CATEGORY_SQL, (selected_zipcode, selected_category), after, limit
+    )
+
+
+def get_popular_businesses(conn, selected_zipcode, selected_category, limit=5):
+    return query(conn, "get_popular_businesses", """
+        SELECT b.name, b.stars, b.review_count
+        FROM businesscategories c JOIN businesses b ON b.business_id = c.business_id
+        WHERE c.postal_code = ? AND c.category = ?
+        ORDER BY b.review_count DESC
+        LIMIT ?;
+    """, (selected_zipcode, selected_category, limit))
+
+
+def get_successful_businesses(conn, selected_zipcode, selected_category, limit=5):
+    return query(conn, "get_successful_businesses", """
+        SELECT b.review_count, b.numCheckins
+        FROM businesscategories c JOIN businesses b ON b.business_id = c.business_id
+        WHERE c.postal_code = ? AND c.category = ?
+        ORDER BY b.numCheckins DESC
+        LIMIT ?;
+    """, (selected_zipcode, selected_category, limit))
+
+
+def get_top_categories(conn, selected_zipcode):
+    return query(conn, "get_top_categories", """
+        SELECT category, business_count
+        FROM zipcodecategories
+        WHERE postal_code = ?
+        ORDER BY business_count DESC, category;
+    """, (selected_zipcode,))
+
+
+# The server versions fold several statements into one round trip; in-process there is none to save
+def get_zipcode_dashboard(conn, selected_zipcode):
+    top_categories = get_top_categories(conn, selected_zipcode)
+    return {
+        "stats": get_zipcode_stats(conn, selected_zipcode),
+        "categories": sorted((category,) for category, _ in top_categories),
+        "top_categories": top_categories,
+    }
+
+
+def get_category_dashboard(conn, selected_zipcode, selected_category, limit=5):
+    return {
+        "popular": get_popular_businesses(conn, selected_zipcode, selected_category, limit),
+        "successful": get_successful_businesses(conn, selected_zipcode, selected_category, limit),
+    }
+
+
+if __name__ == "__main__":
+    # python snapshot.py businessfinder.sqlite -- then BUSINESSFINDER_SNAPSHOT=businessfinder.sqlite python businessfinder.py
+    if len(sys.argv) != 2:
+        sys.exit("usage: python snapshot.py SNAPSHOT_FILE")
+    conn = connect_db()
+    if conn is None:
+        sys.exit("Failed to connect to the database.")
+    started = time.perf_counter()
+    counts = export_snapshot(conn, sys.argv[1])
+    conn.close()
+    print(f"Exported {', '.join(f'{count} {table}' for table, count in counts.items())} to {sys.argv[1]} "
+          f"in {time.perf_counter() - started:.1f}s")
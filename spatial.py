@@ -0,0 +1,159 @@
+import math
+import time
+import threading
+import numpy as np
+from db import get_data_version
+
+EARTH_RADIUS_KM = 6371.0088
+# Grid cells of CELL_DEGREES x CELL_DEGREES (about 11 km north-south), numbered row-major
+CELL_DEGREES = 0.1
+GRID_COLUMNS = round(360 / CELL_DEGREES)
+REFRESH_INTERVAL = 10
+# Businesses committed by a load that was still running at the last refresh are picked up next time
+REFRESH_SLACK = "5 minutes"
+
+BUSINESS_SQL = """
+    SELECT business_id, name, city, state, stars, is_open, categories, latitude, longitude
+    FROM businesses
+    WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+"""
+
+
+def cell_keys(latitudes, longitudes):
+    rows = np.floor((np.clip(latitudes, -90, 90) + 90) / CELL_DEGREES).astype(np.int64)
+    columns = np.floor((np.asarray(longitudes) + 180) / CELL_DEGREES).astype(np.int64) % GRID_COLUMNS
+    return rows * GRID_COLUMNS + columns
+
+
+def haversine_km(lat, lon, latitudes, longitudes):
+    lat, lon = math.radians(lat), math.radians(lon)
+    latitudes, longitudes = np.radians(latitudes), np.radians(longitudes)
+    a = np.sin((latitudes - lat) / 2) ** 2 + math.cos(lat) * np.cos(latitudes) * np.sin((longitudes - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def column_ranges(lon, dlon):
+    # Longitude cell ranges covering lon +/- dlon, split in two where they cross the antimeridian
+    if dlon >= 180:
+        return [(0, GRID_COLUMNS - 1)]
+    first = math.floor((lon - dlon + 180) / CELL_DEGREES)
+    last = math.floor((lon + dlon + 180) / CELL_DEGREES)
+    if first < 0:
+        return [(first + GRID_COLUMNS, GRID_COLUMNS - 1), (0, last)]
+    if last >= GRID_COLUMNS:
+        return [(first, GRID_COLUMNS - 1), (0, last - GRID_COLUMNS)]
+    return [(first, last)]
+
+
+class GridSnapshot:
+    # Immutable arrays sorted by grid cell, so each cell row of a search box is one contiguous slice
+    def __init__(self, businesses):
+        rows = list(businesses.values())
+        latitudes = np.array([row[7] for row in rows], dtype=np.float64)
+        longitudes = np.array([row[8] for row in rows], dtype=np.float64)
+        keys = cell_keys(latitudes, longitudes)
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.latitudes = latitudes[order]
+        self.longitudes = longitudes[order]
+        self.rows = [rows[i] for i in order]
+        self.ids = np.array([row[0] for row in self.rows], dtype=object)
+        self.is_open = np.array([bool(row[5]) for row in self.rows], dtype=bool)
+        self.categories = [
+            frozenset(c.strip() for c in (row[6] or "").split(',') if c.strip()) for row in self.rows
+        ]
+        self.positions = {business_id: i for i, business_id in enumerate(self.ids)}
+
+    def within(self, lat, lon, radius_km, category=None, open_only=False, exclude=None):
+        # Indices and distances of every business within radius_km of (lat, lon)
+        dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+        south, north = max(-90.0, lat - dlat), min(90.0, lat + dlat)
+        widest = math.cos(math.radians(max(abs(south), abs(north))))
+        dlon = 180.0 if widest < 1e-9 else math.degrees(radius_km / (EARTH_RADIUS_KM * widest))
+        first_row, last_row = cell_keys(np.array([south, north]), np.array([0.0, 0.0])) // GRID_COLUMNS
+        rows = np.arange(first_row, last_row + 1, dtype=np.int64) * GRID_COLUMNS
+        starts, ends = [], []
+        for first, last in column_ranges(lon, dlon):
+            starts.append(np.searchsorted(self.keys, rows + first, "left"))
+            ends.append(np.searchsorted(self.keys, rows + last, "right"))
+        starts, ends = np.concatenate(starts), np.concatenate(ends)
+        slices = [np.arange(start, end) for start, end in zip(starts, ends) if end > start]
+        if not slices:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        candidates = np.concatenate(slices)
+        distances = haversine_km(lat, lon, self.latitudes[candidates], self.longitudes[candidates])
+        mask = distances <= radius_km
+        if open_only:
+            mask &= self.is_open[candidates]
+        if exclude is not None:
+            mask &= self.ids[candidates] != exclude
+        candidates, distances = candidates[mask], distances[mask]
+        if category:
+            keep = np.array([category in self.categories[i] for i in candidates], dtype=bool)
+            candidates, distances = candidates[keep], distances[keep]
+        return candidates, distances
+
+
+class SpatialIndex:
+    # In-memory grid over businesses.latitude/longitude. It is loaded on first use and, once
+    # populate.py bumps the data version, only businesses loaded since the last refresh are read.
+    def __init__(self, refresh_interval=REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self.lock = threading.Lock()
+        self.businesses = {}
+        self.snapshot = None
+        self.generation = None
+        self.loaded_until = None
+        self.checked_at = None
+
+    def refresh(self, conn, force=False):
+        with self.lock:
+            now = time.monotonic()
+            if not force and self.snapshot is not None and now - self.checked_at < self.refresh_interval:
+                return self.snapshot
+            self.checked_at = now
+            generation = get_data_version(conn)
+            with conn.cursor() as cur:
+                if self.snapshot is not None and generation == self.generation and not force:
+                    return self.snapshot
+                cur.execute("SELECT now();")
+                loaded_until = cur.fetchone()[0]
+                if self.loaded_until is None:
+                    cur.execute(BUSINESS_SQL + ";")
+                else:
+                    cur.execute(BUSINESS_SQL + f" AND loaded_at > %s - interval '{REFRESH_SLACK}';", (self.loaded_until,))
+                for row in cur.fetchall():
+                    self.businesses[row[0]] = row
+            self.generation = generation
+            self.loaded_until = loaded_until
+            self.snapshot = GridSnapshot(self.businesses)
+            return self.snapshot
+
+    def results(self, snapshot, candidates, distances, k=None):
+        order = np.argsort(distances, kind="stable")[:k]
+        return [
+            snapshot.rows[candidates[i]][:6] + (round(float(distances[i]), 3),)
+            for i in order
+        ]
+
+    def search(self, conn, lat, lon, k=10, radius_km=None, category=None, open_only=False, exclude=None):
+        # (business_id, name, city, state, stars, is_open, distance_km), nearest first. With radius_km
+        # every match inside the radius (at most k if k is set); without it the k nearest anywhere.
+        snapshot = self.refresh(conn)
+        if radius_km:
+            candidates, distances = snapshot.within(lat, lon, radius_km, category, open_only, exclude)
+            return self.results(snapshot, candidates, distances, k)
+        radius = 2.0
+        while True:
+            candidates, distances = snapshot.within(lat, lon, radius, category, open_only, exclude)
+            if len(candidates) >= k or radius >= math.pi * EARTH_RADIUS_KM:
+                return self.results(snapshot, candidates, distances, k)
+            radius *= 4
+
+    def near_business(self, conn, business_id, k=10, radius_km=None, category=None, open_only=False):
+        snapshot = self.refresh(conn)
+        position = snapshot.positions.get(business_id)
+        if position is None:
+            return []
+        lat, lon = float(snapshot.latitudes[position]), float(snapshot.longitudes[position])
+        return self.search(conn, lat, lon, k, radius_km, category, open_only, exclude=business_id)
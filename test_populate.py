@@ -0,0 +1,41 @@
+import random
+import datetime
+import pytest
+from populate import calculate_business_age, calculate_success_score, check_date, review_rows, score_businesses, validate_review
+
+
+def test_score_businesses_matches_scalar_scoring():
+    rng = random.Random(451)
+    today = datetime.date.today()
+    dates = [datetime.date(2000, 1, 1) + datetime.timedelta(days=rng.randrange(10000)) for _ in range(500)]
+    # Anniversaries on either side of today, and leap days
+    dates += [today.replace(year=today.year - 4), today.replace(year=today.year - 4) + datetime.timedelta(days=1),
+              today.replace(year=today.year - 4) - datetime.timedelta(days=1), datetime.date(2012, 2, 29), datetime.date(2000, 2, 29)]
+    repeat = [rng.randrange(50) for _ in dates]
+    positive = [rng.randrange(50) for _ in dates]
+    checkins = [rng.choice([0, rng.randrange(1, 100)]) for _ in dates]
+    reviews = [rng.choice([0, rng.randrange(1, 100)]) for _ in dates]
+
+    ages, scores = score_businesses([d.isoformat() for d in dates], repeat, positive, checkins, reviews)
+
+    for i, date in enumerate(dates):
+        age = calculate_business_age(date)
+        assert ages[i] == age
+        assert scores[i] == pytest.approx(calculate_success_score(age, repeat[i], positive[i], checkins[i], reviews[i]))
+
+
+def test_check_date_wants_zero_padded_iso_dates():
+    assert check_date({"date": "2015-03-07"}, "date") is None
+    assert check_date({"date": "2015-03-07 12:30:00"}, "date") is None
+    assert check_date({}, "date") is None
+    assert check_date({"date": "2015-3-7"}, "date") == "date is not a YYYY-MM-DD date"
+    assert check_date({"date": "2015-02-30"}, "date") == "date is not a YYYY-MM-DD date"
+    assert check_date({"date": 20150307}, "date") == "date is not a YYYY-MM-DD date"
+
+
+def test_review_stars_are_whole_numbers():
+    review = {"review_id": "r", "user_id": "u", "business_id": "b", "stars": 4.0, "date": "2015-03-07"}
+    assert validate_review(review) is None
+    assert review_rows(review)[0][1][3] == 4 and isinstance(review_rows(review)[0][1][3], int)
+    assert validate_review(dict(review, stars=3.5)) == "stars is not a whole number"
+    assert validate_review(dict(review, stars=float("nan"))) == "stars is not a whole number"